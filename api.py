@@ -1,5 +1,11 @@
-from flask import Flask, jsonify, request
+import io
+import threading
+import numpy as np
+import soundfile as sf
+from flask import Flask, Response, jsonify, request
 from main import (
+    config,
+    get_inference_engine,
     run_infer_script,
     run_batch_infer_script,
     run_tts_script,
@@ -12,18 +18,166 @@ from main import (
     run_tensorboard_script,
     run_download_script,
 )
+from rvc.lib.utils import resample_audio
+from rvc.lib.jobs import JobQueue
+from rvc.lib.metrics import metrics
 
 app = Flask(__name__)
 
-def run_script(script_function, required_keys, **kwargs):
-    try:
-        data = request.json
-        missing_keys = [key for key in required_keys if key not in data]
+# Jobs run at most this many at a time per device. Inference shares the one
+# warm engine of this process, so it runs one job at a time; training jobs
+# run in their own process and can be cancelled while running.
+job_limits = {"inference": 1, "training": 1, "download": 2}
+job_queue = JobQueue(job_limits)
+
+# Uploaded conversions wait up to batch_max_wait seconds to be batched with
+# others for the same voice, up to batch_max_size of them. Off by default: a
+# batched request is zero padded in the synthesizer, so its audio can differ
+# very slightly from converting it alone
+batch_max_size = 1
+batch_max_wait = 0
+batch_scheduler = None
+batch_scheduler_lock = threading.Lock()
+
+audio_formats = {
+    "wav": ("WAV", "audio/wav"),
+    "flac": ("FLAC", "audio/flac"),
+    "pcm": (None, "application/octet-stream"),
+}
+
+# name: (function, required keys, job pool or None to run in the request)
+scripts = {
+    "infer": (
+        run_infer_script,
+        [
+            "f0up_key",
+            "filter_radius",
+            "index_rate",
+            "hop_length",
+            "f0method",
+            "input_path",
+            "output_path",
+            "pth_file",
+            "index_path",
+            "split_audio",
+        ],
+        "inference",
+    ),
+    "batch_infer": (
+        run_batch_infer_script,
+        [
+            "f0up_key",
+            "filter_radius",
+            "index_rate",
+            "hop_length",
+            "f0method",
+            "input_folder",
+            "output_folder",
+            "pth_file",
+            "index_path",
+        ],
+        "inference",
+    ),
+    "tts": (
+        run_tts_script,
+        [
+            "tts_text",
+            "tts_voice",
+            "f0up_key",
+            "filter_radius",
+            "index_rate",
+            "hop_length",
+            "f0method",
+            "output_tts_path",
+            "output_rvc_path",
+            "pth_file",
+            "index_path",
+        ],
+        "inference",
+    ),
+    "preprocess": (
+        run_preprocess_script,
+        ["model_name", "dataset_path", "sampling_rate"],
+        "training",
+    ),
+    "extract": (
+        run_extract_script,
+        ["model_name", "rvc_version", "f0method", "hop_length", "sampling_rate"],
+        "training",
+    ),
+    "train": (
+        run_train_script,
+        [
+            "model_name",
+            "rvc_version",
+            "save_every_epoch",
+            "save_only_latest",
+            "save_every_weights",
+            "total_epoch",
+            "sampling_rate",
+            "batch_size",
+            "gpu",
+            "pitch_guidance",
+            "pretrained",
+            "custom_pretrained",
+            "g_pretrained_path",
+            "d_pretrained_path",
+        ],
+        "training",
+    ),
+    "index": (run_index_script, ["model_name", "rvc_version"], "training"),
+    "model_information": (run_model_information_script, ["pth_path"], None),
+    "model_fusion": (
+        run_model_fusion_script,
+        ["model_name", "pth_path_1", "pth_path_2"],
+        "training",
+    ),
+    "tensorboard": (run_tensorboard_script, [], None),
+    "download": (run_download_script, ["model_link"], "download"),
+}
+
+
+def submit(pool, data, function):
+    device = config.device
+    if pool == "training" and "gpu" in data:
+        device = f"gpu{data['gpu']}"
+    return job_queue.submit(pool, device, function, data, isolate=pool != "inference")
+
+
+def check_keys(required_keys, data):
+    missing_keys = [key for key in required_keys if key not in data]
+    if missing_keys:
+        raise ValueError(f"Missing required keys: {', '.join(missing_keys)}")
 
-        if missing_keys:
-            raise ValueError(f"Missing required keys: {', '.join(missing_keys)}")
 
-        result = script_function(**data)
+def submit_script(name, data):
+    script_function, required_keys, pool = scripts[name]
+    check_keys(required_keys, data)
+    return submit(pool, data, script_function)
+
+
+def wait_job(job):
+    # Requests that wait for their job do not keep it around afterwards
+    job.done.wait()
+    job_queue.discard(job.id)
+    if job.status == "cancelled":
+        raise RuntimeError("Job cancelled")
+    if job.status == "failed":
+        if job.error_type == "ValueError":
+            raise ValueError(job.error)
+        raise RuntimeError(job.error)
+    return job.result
+
+
+def run_script(name):
+    try:
+        data = request.json if request.method == "POST" else {}
+        script_function, required_keys, pool = scripts[name]
+        if pool is None:
+            check_keys(required_keys, data)
+            result = script_function(**data)
+        else:
+            result = wait_job(submit_script(name, data))
         return jsonify({"message": result}), 200
 
     except ValueError as value_error:
@@ -31,70 +185,227 @@ def run_script(script_function, required_keys, **kwargs):
     except Exception as error:
         return jsonify({"error": str(error)}), 500
 
+
+def get_batch_scheduler():
+    global batch_scheduler
+    with batch_scheduler_lock:
+        if batch_scheduler is None:
+            from rvc.infer.batching import BatchScheduler
+
+            # Every batch is one inference job, so it takes turns with the others
+            batch_scheduler = BatchScheduler(
+                get_inference_engine(),
+                max_batch=batch_max_size,
+                max_wait=batch_max_wait,
+                executor=lambda function: wait_job(submit("inference", {}, function)),
+            )
+        return batch_scheduler
+
+
+def read_upload():
+    # Multipart form with an "audio" file, or the raw file as the request
+    # body with the parameters in the query string
+    if "audio" in request.files:
+        return request.files["audio"].read(), request.form
+    return request.get_data(), request.args
+
+
+def encode_audio(audio, sr, audio_format):
+    with metrics.timer("encode"):
+        if audio_format == "pcm":
+            # Headerless 16-bit little-endian mono
+            return audio.astype("<i2").tobytes()
+        buffer = io.BytesIO()
+        sf.write(
+            buffer, audio, sr, format=audio_formats[audio_format][0], subtype="PCM_16"
+        )
+        return buffer.getvalue()
+
+
+def stream_bytes(data, chunk_size=64 * 1024):
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start : start + chunk_size])
+
+
+def infer_upload():
+    try:
+        data, params = read_upload()
+        if not data:
+            raise ValueError("Missing audio")
+        if "pth_file" not in params:
+            raise ValueError("Missing required keys: pth_file")
+        audio_format = params.get("format", "wav").lower()
+        if audio_format not in audio_formats:
+            raise ValueError(f"Unsupported format: {audio_format}")
+        sample_rate = int(params.get("sample_rate", 0))
+
+        # Uploads go through the batch scheduler, which micro-batches them
+        # with concurrent requests for the same voice when enabled
+        result = get_batch_scheduler().convert(
+            params["pth_file"],
+            data,
+            f0_up_key=params.get("f0up_key", 0),
+            f0_method=params.get("f0method", "rmvpe"),
+            index_path=params.get("index_path", ""),
+            index_rate=params.get("index_rate", 0.75),
+            protect=float(params.get("protect", 0.33)),
+            filter_radius=params.get("filter_radius", 3),
+            hop_length=params.get("hop_length", 128),
+        )
+        if result is None or result[1] is None:
+            raise RuntimeError("Conversion failed")
+        tgt_sr, audio_opt = result
+
+        if sample_rate > 0 and sample_rate != tgt_sr:
+            with metrics.timer("resample"):
+                audio_opt = resample_audio(
+                    audio_opt.astype(np.float32) / 32768, tgt_sr, sample_rate
+                )
+                audio_opt = (np.clip(audio_opt, -1, 32767 / 32768) * 32768).astype(
+                    np.int16
+                )
+            tgt_sr = sample_rate
+
+        body = encode_audio(audio_opt, tgt_sr, audio_format)
+        headers = {"Content-Length": str(len(body)), "X-Sample-Rate": str(tgt_sr)}
+        return Response(
+            stream_bytes(body), mimetype=audio_formats[audio_format][1], headers=headers
+        )
+
+    except ValueError as value_error:
+        return jsonify({"error": str(value_error)}), 400
+    except Exception as error:
+        return jsonify({"error": str(error)}), 500
+
+
 # Infer
 @app.route("/infer", methods=["POST"])
 def infer():
-    required_keys = ["f0up_key", "filter_radius", "index_rate", "hop_length", "f0method", "input_path", "output_path", "pth_file", "index_path", "split_audio"]
-    return run_script(run_infer_script, required_keys)
+    if not request.is_json:
+        return infer_upload()
+    return run_script("infer")
+
 
 # Batch Infer
 @app.route("/batch_infer", methods=["POST"])
 def batch_infer():
-    required_keys = ["f0up_key", "filter_radius", "index_rate", "hop_length", "f0method", "input_folder", "output_folder", "pth_file", "index_path"]
-    return run_script(run_batch_infer_script, required_keys)
+    return run_script("batch_infer")
+
 
 # TTS
 @app.route("/tts", methods=["POST"])
 def tts():
-    required_keys = ["tts_text", "tts_voice", "f0up_key", "filter_radius", "index_rate", "hop_length", "f0method", "output_tts_path", "output_rvc_path", "pth_file", "index_path"]
-    return run_script(run_tts_script, required_keys)
+    return run_script("tts")
+
 
 # Preprocess
 @app.route("/preprocess", methods=["POST"])
 def preprocess():
-    required_keys = ["model_name", "dataset_path", "sampling_rate"]
-    return run_script(run_preprocess_script, required_keys)
+    return run_script("preprocess")
+
 
 # Extract
 @app.route("/extract", methods=["POST"])
 def extract():
-    required_keys = ["model_name", "rvc_version", "f0method", "hop_length", "sampling_rate"]
-    return run_script(run_extract_script, required_keys)
+    return run_script("extract")
+
 
 # Train
 @app.route("/train", methods=["POST"])
 def train():
-    required_keys = ["model_name", "rvc_version", "save_every_epoch", "save_only_latest", "save_every_weights", "total_epoch", "sampling_rate", "batch_size", "gpu", "pitch_guidance", "pretrained", "custom_pretrained", "g_pretrained_path", "d_pretrained_path"]
-    return run_script(run_train_script, required_keys)
+    return run_script("train")
+
 
 # Index
 @app.route("/index", methods=["POST"])
 def index():
-    required_keys = ["model_name", "rvc_version"]
-    return run_script(run_index_script, required_keys)
+    return run_script("index")
+
 
 # Model Information
 @app.route("/model_information", methods=["POST"])
 def model_information():
-    required_keys = ["pth_path"]
-    return run_script(run_model_information_script, required_keys)
+    return run_script("model_information")
+
 
 # Model Fusion
 @app.route("/model_fusion", methods=["POST"])
 def model_fusion():
-    required_keys = ["model_name", "pth_path_1", "pth_path_2"]
-    return run_script(run_model_fusion_script, required_keys)
+    return run_script("model_fusion")
+
 
 # Tensorboard
 @app.route("/tensorboard", methods=["GET"])
 def tensorboard():
-    return run_script(run_tensorboard_script, [])
+    return run_script("tensorboard")
+
 
 # Download
 @app.route("/download", methods=["POST"])
 def download():
-    required_keys = ["model_link"]
-    return run_script(run_download_script, required_keys)
+    return run_script("download")
+
+
+# Jobs
+@app.route("/jobs/<name>", methods=["POST"])
+def submit_job(name):
+    try:
+        if name not in scripts or scripts[name][2] is None:
+            return jsonify({"error": f"Unknown job: {name}"}), 404
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        job = submit_script(name, data)
+        return jsonify({"job_id": job.id}), 202
+    except ValueError as value_error:
+        return jsonify({"error": str(value_error)}), 400
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if not job.done.is_set():
+        return jsonify(job.to_dict()), 409
+    if job.status != "done":
+        return jsonify(job.to_dict()), 500
+    return jsonify({"message": job.result}), 200
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route("/jobs", methods=["GET"])
+def job_stats():
+    stats = job_queue.stats()
+    if batch_scheduler is not None:
+        stats["batching"] = batch_scheduler.stats()
+    return jsonify(stats), 200
+
+
+# Metrics
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    for queue_name, stats in job_queue.stats().items():
+        metrics.set_gauge("job_queue_depth", stats["queued"], queue=queue_name)
+        metrics.set_gauge("jobs_running", stats["running"], queue=queue_name)
+    return Response(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
 
 if __name__ == "__main__":
     app.run()
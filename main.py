@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 import argparse
 import subprocess
 
@@ -20,6 +21,7 @@ from rvc.lib.tools.pretrained_selector import pretrained_selector
 
 from rvc.lib.process.model_fusion import model_fusion
 from rvc.lib.process.model_information import model_information
+from rvc.lib.metrics import metrics
 
 config = Config()
 current_script_directory = os.path.dirname(os.path.realpath(__file__))
@@ -30,6 +32,13 @@ subprocess.run(
 
 
 # Infer
+def get_inference_engine():
+    # Imported lazily so training commands do not pay for fairseq and faiss
+    from rvc.infer.infer import get_inference_engine
+
+    return get_inference_engine()
+
+
 def run_infer_script(
     f0up_key,
     filter_radius,
@@ -41,24 +50,29 @@ def run_infer_script(
     pth_file,
     index_path,
     split_audio,
+    batch_size=1,
+    f0_processes=1,
+    f0_cache=None,
+    feature_cache=None,
+    feature_cache_gb=2,
 ):
-    infer_script_path = os.path.join("rvc", "infer", "infer.py")
-
-    command = [
-        "python",
-        infer_script_path,
-        str(f0up_key),
-        str(filter_radius),
-        str(index_rate),
-        str(hop_length),
+    engine = get_inference_engine()
+    engine.set_f0_cache(f0_cache)
+    engine.set_feature_cache(feature_cache, int(float(feature_cache_gb) * 1024**3))
+    engine.infer(
+        f0up_key,
+        filter_radius,
+        index_rate,
+        hop_length,
         f0method,
         input_path,
         output_path,
         pth_file,
         index_path,
-        str(split_audio),
-    ]
-    subprocess.run(command)
+        split_audio,
+        batch_size,
+        f0_processes,
+    )
     return f"File {input_path} inferred successfully.", output_path
 
 
@@ -73,44 +87,172 @@ def run_batch_infer_script(
     output_folder,
     pth_file,
     index_path,
+    batch_size=1,
+    f0_processes=1,
+    workers=0,
+    f0_cache=None,
+    feature_cache=None,
+    feature_cache_gb=2,
+    progress=None,
 ):
-    infer_script_path = os.path.join("rvc", "infer", "infer.py")
+    from rvc.infer.batch_infer import BatchManifest, run_batch
 
     audio_files = [
         f for f in os.listdir(input_folder) if f.endswith((".mp3", ".wav", ".flac"))
     ]
     print(f"Detected {len(audio_files)} audio files for inference.")
 
+    params = {
+        "f0up_key": f0up_key,
+        "filter_radius": filter_radius,
+        "index_rate": index_rate,
+        "hop_length": hop_length,
+        "f0method": f0method,
+        "pth_file": pth_file,
+        "index_path": index_path,
+        "batch_size": batch_size,
+        "f0_processes": f0_processes,
+    }
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, "batch_manifest.jsonl")
+    # Outputs are only trusted without a record when no run kept a manifest;
+    # after that a missing record means the output may be partial
+    legacy_outputs = not os.path.exists(manifest_path)
+    manifest = BatchManifest(manifest_path)
+    params_hash = BatchManifest.params_hash(params)
+
+    jobs = []
+    file_hashes = {}
+    up_to_date = 0
     for audio_file in audio_files:
         if "_output" in audio_file:
-            pass
-        else:
-            input_path = os.path.join(input_folder, audio_file)
-            output_file_name = os.path.splitext(os.path.basename(audio_file))[0]
-            output_path = os.path.join(
-                output_folder,
-                f"{output_file_name}_output{os.path.splitext(audio_file)[1]}",
-            )
-            print(f"Inferring {input_path}...")
-
-        command = [
-            "python",
-            infer_script_path,
-            str(f0up_key),
-            str(filter_radius),
-            str(index_rate),
-            str(hop_length),
-            f0method,
-            input_path,
-            output_path,
-            pth_file,
-            index_path,
-        ]
-        subprocess.run(command)
+            continue
+        input_path = os.path.join(input_folder, audio_file)
+        output_file_name = os.path.splitext(os.path.basename(audio_file))[0]
+        output_path = os.path.join(
+            output_folder,
+            f"{output_file_name}_output{os.path.splitext(audio_file)[1]}",
+        )
+        file_hash = manifest.file_hash(input_path)
+        if manifest.is_current(input_path, file_hash, params_hash, output_path):
+            up_to_date += 1
+            continue
+        if legacy_outputs and os.path.exists(output_path):
+            # Output left by a run from before the manifest existed
+            manifest.record(input_path, output_path, file_hash, params_hash, "done")
+            up_to_date += 1
+            continue
+        file_hashes[input_path] = file_hash
+        jobs.append((input_path, output_path))
+    print(f"{up_to_date} files are up to date, {len(jobs)} to infer.")
+
+    finished = set()
+
+    def on_result(input_path, output_path, error):
+        status = "done" if error is None else "failed"
+        manifest.record(
+            input_path, output_path, file_hashes[input_path], params_hash, status
+        )
+        finished.add(input_path)
+        if progress is not None:
+            progress(len(finished) / len(jobs))
+
+    if jobs:
+        run_batch(
+            jobs,
+            params,
+            workers=int(workers),
+            on_result=on_result,
+            f0_cache=f0_cache,
+            feature_cache=(feature_cache, int(float(feature_cache_gb) * 1024**3)),
+        )
 
     return f"Files from {input_folder} inferred successfully."
 
 
+# Fan-out infer
+def run_fanout_infer_script(
+    filter_radius,
+    hop_length,
+    f0method,
+    input_path,
+    output_folder,
+    voices,
+    batch_size=1,
+    f0_processes=1,
+):
+    input_name = os.path.splitext(os.path.basename(input_path))[0]
+    targets = []
+    for pth_file, index_path, f0up_key, index_rate in voices:
+        model_name = os.path.splitext(os.path.basename(pth_file))[0]
+        targets.append(
+            {
+                "pth_file": pth_file,
+                "index_path": index_path,
+                "f0up_key": f0up_key,
+                "index_rate": index_rate,
+                "output_path": os.path.join(
+                    output_folder, f"{input_name}_{model_name}.wav"
+                ),
+            }
+        )
+    os.makedirs(output_folder, exist_ok=True)
+    get_inference_engine().fan_out(
+        input_path,
+        targets,
+        f0method,
+        filter_radius=filter_radius,
+        hop_length=hop_length,
+        batch_size=batch_size,
+        f0_processes=f0_processes,
+    )
+    return f"File {input_path} inferred with {len(targets)} voices successfully."
+
+
+# Stream infer
+def run_stream_infer_script(
+    f0up_key,
+    index_rate,
+    f0method,
+    input_path,
+    output_path,
+    pth_file,
+    index_path,
+    block_time=0.25,
+    crossfade_time=0.05,
+    lookahead_time=0.05,
+    max_discontinuity=2.0,
+):
+    from rvc.infer.stream import StreamingConverter, stream_file
+
+    converter = StreamingConverter(
+        get_inference_engine(),
+        pth_file,
+        index_path,
+        f0_up_key=f0up_key,
+        f0_method=f0method,
+        index_rate=index_rate,
+        block_time=float(block_time),
+        crossfade_time=float(crossfade_time),
+        lookahead_time=float(lookahead_time),
+    )
+    max_discontinuity = float(max_discontinuity)
+    stats = stream_file(
+        converter,
+        input_path,
+        output_path,
+        tolerance=max_discontinuity if max_discontinuity > 0 else None,
+    )
+    print(
+        f"Streamed {stats['blocks']} blocks of {stats['block_time']}s, "
+        f"algorithmic latency {stats['algorithmic_latency']:.3f}s, "
+        f"compute latency {stats['compute_latency_mean']:.3f}s "
+        f"(max {stats['compute_latency_max']:.3f}s), "
+        f"boundary discontinuity {stats['discontinuity']:.2f}"
+    )
+    return f"File {input_path} streamed successfully.", output_path
+
+
 # TTS
 def run_tts_script(
     tts_text,
@@ -126,7 +268,6 @@ def run_tts_script(
     index_path,
 ):
     tts_script_path = os.path.join("rvc", "lib", "tools", "tts.py")
-    infer_script_path = os.path.join("rvc", "infer", "infer.py")
 
     if os.path.exists(output_tts_path):
         os.remove(output_tts_path)
@@ -139,21 +280,18 @@ def run_tts_script(
         output_tts_path,
     ]
 
-    command_infer = [
-        "python",
-        infer_script_path,
-        str(f0up_key),
-        str(filter_radius),
-        str(index_rate),
-        str(hop_length),
+    subprocess.run(command_tts)
+    get_inference_engine().infer(
+        f0up_key,
+        filter_radius,
+        index_rate,
+        hop_length,
         f0method,
         output_tts_path,
         output_rvc_path,
         pth_file,
         index_path,
-    ]
-    subprocess.run(command_tts)
-    subprocess.run(command_infer)
+    )
     return f"Text {tts_text} synthesized successfully.", output_rvc_path
 
 
@@ -282,13 +420,14 @@ def run_train_script(
 
 
 # Index
-def run_index_script(model_name, rvc_version):
+def run_index_script(model_name, rvc_version, sidecar_dtype="float32"):
     index_script_path = os.path.join("rvc", "train", "process", "extract_index.py")
     command = [
         "python",
         index_script_path,
         os.path.join(logs_path, str(model_name)),
         rvc_version,
+        sidecar_dtype,
     ]
 
     subprocess.run(command)
@@ -329,11 +468,46 @@ def run_download_script(model_link):
     return f"Model downloaded successfully."
 
 
+# Benchmark
+def run_benchmark_script(
+    suites,
+    versions,
+    f0methods,
+    lengths,
+    rmvpe_minutes,
+    f0_processes,
+    long_minutes,
+    real_models,
+    output_path,
+):
+    from rvc.infer.benchmark import run_benchmark
+
+    results = run_benchmark(
+        suites=suites.split(","),
+        versions=versions.split(","),
+        f0methods=f0methods.split(","),
+        lengths=[int(length) for length in lengths.split(",")],
+        rmvpe_minutes=[float(minutes) for minutes in rmvpe_minutes.split(",")],
+        f0_processes=f0_processes or None,
+        long_minutes=long_minutes,
+        real_models=str(real_models) == "True",
+        output_path=output_path,
+    )
+    if not output_path:
+        print(json.dumps(results, indent=2))
+    return "Benchmark finished successfully.", output_path
+
+
 # Parse arguments
 def parse_arguments():
     parser = argparse.ArgumentParser(
         description="Run the main.py script with specific parameters."
     )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Print per-stage timings and cache counters as JSON when done",
+    )
     subparsers = parser.add_subparsers(
         title="subcommands", dest="mode", help="Choose a mode"
     )
@@ -384,6 +558,36 @@ def parse_arguments():
         type=validate_true_false,
         help="Enable split audio (True or False)",
     )
+    infer_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of audio segments converted per synthesizer pass (HuBERT only batches segments of equal length)",
+    )
+    infer_parser.add_argument(
+        "--f0_processes",
+        type=int,
+        default=1,
+        help="Processes used to extract harvest or dio F0 in parallel",
+    )
+    infer_parser.add_argument(
+        "--f0_cache",
+        type=str,
+        default=None,
+        help="Folder to keep F0 curves in between runs (enclose in double quotes)",
+    )
+    infer_parser.add_argument(
+        "--feature_cache",
+        type=str,
+        default=None,
+        help="Folder to keep HuBERT features in between runs (enclose in double quotes)",
+    )
+    infer_parser.add_argument(
+        "--feature_cache_gb",
+        type=float,
+        default=2,
+        help="Size limit of the feature cache folder in GB",
+    )
 
     # Parser for 'batch_infer' mode
     batch_infer_parser = subparsers.add_parser(
@@ -428,6 +632,146 @@ def parse_arguments():
         type=str,
         help="Path to the .index file (enclose in double quotes)",
     )
+    batch_infer_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of audio segments converted per synthesizer pass (HuBERT only batches segments of equal length)",
+    )
+    batch_infer_parser.add_argument(
+        "--f0_processes",
+        type=int,
+        default=1,
+        help="Processes used to extract harvest or dio F0 in parallel",
+    )
+    batch_infer_parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Worker processes with their own warm models, 0 picks from cores and memory",
+    )
+    batch_infer_parser.add_argument(
+        "--f0_cache",
+        type=str,
+        default=None,
+        help="Folder to keep F0 curves in between runs (enclose in double quotes)",
+    )
+    batch_infer_parser.add_argument(
+        "--feature_cache",
+        type=str,
+        default=None,
+        help="Folder to keep HuBERT features in between runs (enclose in double quotes)",
+    )
+    batch_infer_parser.add_argument(
+        "--feature_cache_gb",
+        type=float,
+        default=2,
+        help="Size limit of the feature cache folder in GB",
+    )
+
+    # Parser for 'fanout_infer' mode
+    fanout_infer_parser = subparsers.add_parser(
+        "fanout_infer", help="Run inference of one input with several voices"
+    )
+    fanout_infer_parser.add_argument(
+        "filter_radius",
+        type=str,
+        help="Value for filter_radius (0 to 10)",
+    )
+    fanout_infer_parser.add_argument(
+        "hop_length",
+        type=str,
+        help="Value for hop_length (1 to 512)",
+    )
+    fanout_infer_parser.add_argument(
+        "f0method",
+        type=validate_f0method,
+        help="Value for f0method (pm, dio, crepe, crepe-tiny, harvest, rmvpe)",
+    )
+    fanout_infer_parser.add_argument(
+        "input_path", type=str, help="Input path (enclose in double quotes)"
+    )
+    fanout_infer_parser.add_argument(
+        "output_folder", type=str, help="Output folder (enclose in double quotes)"
+    )
+    fanout_infer_parser.add_argument(
+        "--voice",
+        nargs=4,
+        action="append",
+        required=True,
+        metavar=("PTH_FILE", "INDEX_PATH", "F0UP_KEY", "INDEX_RATE"),
+        help="Voice to convert to, repeat for every voice",
+    )
+    fanout_infer_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of audio segments converted per synthesizer pass (HuBERT only batches segments of equal length)",
+    )
+    fanout_infer_parser.add_argument(
+        "--f0_processes",
+        type=int,
+        default=1,
+        help="Processes used to extract harvest or dio F0 in parallel",
+    )
+
+    # Parser for 'stream_infer' mode
+    stream_infer_parser = subparsers.add_parser(
+        "stream_infer", help="Run block-wise streaming inference on a file"
+    )
+    stream_infer_parser.add_argument(
+        "f0up_key",
+        type=validate_f0up_key,
+        help="Value for f0up_key (-24 to +24)",
+    )
+    stream_infer_parser.add_argument(
+        "index_rate",
+        type=str,
+        help="Value for index_rate (0.0 to 1)",
+    )
+    stream_infer_parser.add_argument(
+        "f0method",
+        type=validate_f0method,
+        help="Value for f0method (pm, dio, crepe, crepe-tiny, rmvpe)",
+    )
+    stream_infer_parser.add_argument(
+        "input_path", type=str, help="Input path (enclose in double quotes)"
+    )
+    stream_infer_parser.add_argument(
+        "output_path", type=str, help="Output path (enclose in double quotes)"
+    )
+    stream_infer_parser.add_argument(
+        "pth_file", type=str, help="Path to the .pth file (enclose in double quotes)"
+    )
+    stream_infer_parser.add_argument(
+        "index_path",
+        type=str,
+        help="Path to the .index file (enclose in double quotes)",
+    )
+    stream_infer_parser.add_argument(
+        "--block_time",
+        type=float,
+        default=0.25,
+        help="Block length in seconds",
+    )
+    stream_infer_parser.add_argument(
+        "--crossfade_time",
+        type=float,
+        default=0.05,
+        help="Crossfade between output blocks in seconds",
+    )
+    stream_infer_parser.add_argument(
+        "--lookahead_time",
+        type=float,
+        default=0.05,
+        help="Future audio waited for before a block is emitted, in seconds",
+    )
+    stream_infer_parser.add_argument(
+        "--max_discontinuity",
+        type=float,
+        default=2.0,
+        help="Fail when the boundary discontinuity is above this, 0 disables the check",
+    )
 
     # Parser for 'tts' mode
     tts_parser = subparsers.add_parser("tts", help="Run TTS")
@@ -614,6 +958,13 @@ def parse_arguments():
         type=str,
         help="Version of the model (v1 or v2)",
     )
+    index_parser.add_argument(
+        "--sidecar_dtype",
+        type=str,
+        choices=["float32", "float16"],
+        default="float32",
+        help="Data type of the feature file saved next to the index (float32 or float16)",
+    )
 
     # Parser for 'model_information' mode
     model_information_parser = subparsers.add_parser(
@@ -654,6 +1005,65 @@ def parse_arguments():
         help="Link of the model (enclose in double quotes)",
     )
 
+    # Parser for 'benchmark' mode
+    benchmark_parser = subparsers.add_parser(
+        "benchmark", help="Benchmark the inference pipeline"
+    )
+    benchmark_parser.add_argument(
+        "--suites",
+        type=str,
+        default="pipeline,engine,batching,rmvpe,f0_parallel,decode,silence,slicer",
+        help="Comma separated suites to run",
+    )
+    benchmark_parser.add_argument(
+        "--versions",
+        type=str,
+        default="v1,v2",
+        help="Comma separated model versions (v1, v2)",
+    )
+    benchmark_parser.add_argument(
+        "--f0methods",
+        type=str,
+        default="pm,dio,harvest,rmvpe",
+        help="Comma separated f0 methods (pm, dio, crepe, crepe-tiny, harvest, rmvpe)",
+    )
+    benchmark_parser.add_argument(
+        "--lengths",
+        type=str,
+        default="5,30,120",
+        help="Comma separated lengths in seconds of the test audio",
+    )
+    benchmark_parser.add_argument(
+        "--rmvpe_minutes",
+        type=str,
+        default="1,15,60",
+        help="Comma separated lengths in minutes for the RMVPE decode benchmark",
+    )
+    benchmark_parser.add_argument(
+        "--f0_processes",
+        type=int,
+        default=0,
+        help="Processes for the parallel F0 benchmark (0 for one per core, up to 8)",
+    )
+    benchmark_parser.add_argument(
+        "--long_minutes",
+        type=float,
+        default=60,
+        help="Length in minutes of the audio for the silence detection benchmark",
+    )
+    benchmark_parser.add_argument(
+        "--real_models",
+        type=validate_true_false,
+        default="False",
+        help="Use hubert_base.pt and rmvpe.pt instead of random weights (True or False)",
+    )
+    benchmark_parser.add_argument(
+        "--output_path",
+        type=str,
+        default=None,
+        help="Write the results as JSON to this path instead of printing them",
+    )
+
     return parser.parse_args()
 
 
@@ -677,6 +1087,11 @@ def main():
                 args.pth_file,
                 args.index_path,
                 args.split_audio,
+                args.batch_size,
+                args.f0_processes,
+                args.f0_cache,
+                args.feature_cache,
+                args.feature_cache_gb,
             )
         elif args.mode == "batch_infer":
             run_batch_infer_script(
@@ -689,6 +1104,37 @@ def main():
                 args.output_folder,
                 args.pth_file,
                 args.index_path,
+                args.batch_size,
+                args.f0_processes,
+                args.workers,
+                args.f0_cache,
+                args.feature_cache,
+                args.feature_cache_gb,
+            )
+        elif args.mode == "fanout_infer":
+            run_fanout_infer_script(
+                args.filter_radius,
+                args.hop_length,
+                args.f0method,
+                args.input_path,
+                args.output_folder,
+                args.voice,
+                args.batch_size,
+                args.f0_processes,
+            )
+        elif args.mode == "stream_infer":
+            run_stream_infer_script(
+                args.f0up_key,
+                args.index_rate,
+                args.f0method,
+                args.input_path,
+                args.output_path,
+                args.pth_file,
+                args.index_path,
+                args.block_time,
+                args.crossfade_time,
+                args.lookahead_time,
+                args.max_discontinuity,
             )
         elif args.mode == "tts":
             run_tts_script(
@@ -740,6 +1186,7 @@ def main():
             run_index_script(
                 args.model_name,
                 args.rvc_version,
+                args.sidecar_dtype,
             )
         elif args.mode == "model_information":
             run_model_information_script(
@@ -757,9 +1204,24 @@ def main():
             run_download_script(
                 args.model_link,
             )
+        elif args.mode == "benchmark":
+            run_benchmark_script(
+                args.suites,
+                args.versions,
+                args.f0methods,
+                args.lengths,
+                args.rmvpe_minutes,
+                args.f0_processes,
+                args.long_minutes,
+                args.real_models,
+                args.output_path,
+            )
     except Exception as error:
         print(f"Error: {error}")
 
+    if args.metrics:
+        print(json.dumps(metrics.summary(), indent=2))
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
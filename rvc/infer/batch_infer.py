@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import hashlib
+import multiprocessing
+from time import time as ttime
+
+import torch
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+
+from rvc.infer.infer import get_inference_engine
+from rvc.lib.metrics import metrics
+
+# Resident memory of a warm worker besides the voice model and index:
+# HuBERT, RMVPE and the interpreter with torch loaded
+worker_base_bytes = 1536 * 1024**2
+
+
+def available_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def choose_workers(pth_file, index_path, device):
+    """
+    One worker per core, as long as a warm copy of the models fits in the
+    available memory. GPU inference keeps a single in-process worker.
+    """
+    if not str(device).startswith("cpu"):
+        return 1
+    worker_bytes = worker_base_bytes + os.path.getsize(pth_file)
+    if index_path and os.path.exists(index_path):
+        worker_bytes += os.path.getsize(index_path)
+    workers = multiprocessing.cpu_count()
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, memory // worker_bytes)
+    return max(1, int(workers))
+
+
+def init_worker(
+    pth_file, index_path, num_threads, f0_cache=None, feature_cache=(None,)
+):
+    torch.set_num_threads(num_threads)
+    engine = get_inference_engine()
+    engine.set_f0_cache(f0_cache)
+    engine.set_feature_cache(*feature_cache)
+    engine.load_hubert()
+    engine.get_vc(pth_file)
+    file_index = index_path.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
+    file_index = file_index.replace("trained", "added")
+    if file_index and os.path.exists(file_index):
+        engine.vc.load_index(file_index)
+
+
+def convert_file(job):
+    input_path, output_path, params = job
+    t0 = ttime()
+    # Pool workers send their stage timings back with each result
+    in_worker = multiprocessing.current_process().name != "MainProcess"
+    error, seconds = None, 0.0
+    # Written next to the output and moved in place once complete, so an
+    # interrupted run never leaves a partial file under the output name
+    partial_path = os.path.join(
+        os.path.dirname(output_path), f".{os.path.basename(output_path)}.partial"
+    )
+    try:
+        result = get_inference_engine().infer(
+            params["f0up_key"],
+            params["filter_radius"],
+            params["index_rate"],
+            params["hop_length"],
+            params["f0method"],
+            input_path,
+            partial_path,
+            params["pth_file"],
+            params["index_path"],
+            batch_size=params["batch_size"],
+            f0_processes=params["f0_processes"],
+        )
+        if result is None or result[1] is None:
+            raise RuntimeError(f"Conversion of {input_path} produced no audio")
+        tgt_sr, audio_opt = result
+        seconds = len(audio_opt) / tgt_sr
+        os.replace(partial_path, output_path)
+    except Exception as conversion_error:
+        error = str(conversion_error)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    stage_metrics = metrics.take() if in_worker else None
+    return input_path, output_path, error, seconds, ttime() - t0, stage_metrics
+
+
+class BatchManifest:
+    """
+    Append-only JSONL record of a batch run: for every input its content
+    hash, a hash of the conversion parameters, the output path and the
+    status. The last line written for an input wins, so a crashed run
+    leaves a usable manifest and a rerun only converts inputs that are new,
+    changed, failed, or whose parameters or output changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Partial line left by an interrupted run
+                        continue
+                    self.entries[entry["input_path"]] = entry
+
+    @staticmethod
+    def params_hash(params):
+        params = dict(params)
+        for key in ("pth_file", "index_path"):
+            if params.get(key) and os.path.exists(params[key]):
+                params[f"{key}_mtime"] = os.path.getmtime(params[key])
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def file_hash(self, input_path):
+        # Hashing is skipped while size and mtime match the last record
+        stat = os.stat(input_path)
+        entry = self.entries.get(os.path.abspath(input_path))
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+        ):
+            return entry["hash"]
+        digest = hashlib.sha1()
+        with open(input_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def is_current(self, input_path, file_hash, params_hash, output_path):
+        entry = self.entries.get(os.path.abspath(input_path))
+        return (
+            entry is not None
+            and entry["status"] == "done"
+            and entry["hash"] == file_hash
+            and entry["params"] == params_hash
+            and entry["output_path"] == os.path.abspath(output_path)
+            and os.path.exists(output_path)
+        )
+
+    def record(self, input_path, output_path, file_hash, params_hash, status):
+        stat = os.stat(input_path)
+        entry = {
+            "input_path": os.path.abspath(input_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": file_hash,
+            "params": params_hash,
+            "output_path": os.path.abspath(output_path),
+            "status": status,
+        }
+        self.entries[entry["input_path"]] = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+def run_batch(
+    jobs,
+    params,
+    workers=0,
+    retries=1,
+    on_result=None,
+    f0_cache=None,
+    feature_cache=(None,),
+):
+    """
+    Convert (input_path, output_path) jobs with workers processes that each
+    keep HuBERT, the voice model and the index loaded. Files are handed out
+    one at a time so fast workers keep pulling work; failed files are
+    retried up to retries times. workers=0 picks the count automatically.
+    on_result(input_path, output_path, error) is called as files finish.
+    f0_cache is the folder of the F0 cache and feature_cache is (cache_dir,
+    max_bytes) for the HuBERT feature cache, the workers share both.
+    """
+    if workers <= 0:
+        device = get_inference_engine().config.device
+        workers = choose_workers(params["pth_file"], params["index_path"], device)
+    workers = max(1, min(workers, len(jobs)))
+    if workers > 1:
+        # Pool workers are daemonic and cannot start an F0 pool of their own
+        params = dict(params, f0_processes=1)
+    num_threads = max(1, multiprocessing.cpu_count() // workers)
+    print(f"Converting {len(jobs)} files with {workers} workers")
+
+    t0 = ttime()
+    audio_seconds = 0.0
+    converted = 0
+    failed = []
+    pending = [(input_path, output_path, params) for input_path, output_path in jobs]
+
+    if workers > 1:
+        pool = multiprocessing.Pool(
+            workers,
+            initializer=init_worker,
+            initargs=(
+                params["pth_file"],
+                params["index_path"],
+                num_threads,
+                f0_cache,
+                feature_cache,
+            ),
+        )
+    else:
+        pool = None
+        get_inference_engine().set_f0_cache(f0_cache)
+        get_inference_engine().set_feature_cache(*feature_cache)
+
+    try:
+        for attempt in range(retries + 1):
+            if not pending:
+                break
+            if pool is not None:
+                results = pool.imap_unordered(convert_file, pending)
+            else:
+                results = map(convert_file, pending)
+            retry = []
+            for result in results:
+                input_path, output_path, error, seconds, elapsed, stage_metrics = result
+                if stage_metrics is not None:
+                    metrics.merge(stage_metrics)
+                if on_result is not None:
+                    on_result(input_path, output_path, error)
+                if error is None:
+                    converted += 1
+                    audio_seconds += seconds
+                    print(f"Converted {input_path} -> {output_path} in {elapsed:.2f}s")
+                else:
+                    print(f"Failed to convert {input_path}: {error}")
+                    retry.append((input_path, output_path, params))
+            pending = retry
+        failed = [input_path for input_path, _, _ in pending]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = ttime() - t0
+    summary = {
+        "files": converted,
+        "failed": failed,
+        "workers": workers,
+        "elapsed": elapsed,
+        "files_per_second": converted / elapsed if elapsed > 0 else 0.0,
+        "realtime_factor": audio_seconds / elapsed if elapsed > 0 else 0.0,
+    }
+    print(
+        f"Converted {converted} files ({audio_seconds:.1f}s of audio) in "
+        f"{elapsed:.1f}s: {summary['files_per_second']:.2f} files/s, "
+        f"{summary['realtime_factor']:.2f}x realtime, {len(failed)} failed"
+    )
+    return summary
@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import threading
+import numpy as np
+import torch
+from collections import deque
+from concurrent.futures import Future
+from time import time as ttime
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+
+from rvc.lib.utils import load_audio
+from rvc.lib.metrics import metrics
+
+
+class ConversionRequest:
+    def __init__(
+        self,
+        pth_file,
+        audio,
+        f0_up_key,
+        f0_method,
+        index_path,
+        index_rate,
+        protect,
+        filter_radius,
+        hop_length,
+        sid,
+    ):
+        self.pth_file = pth_file
+        self.audio = audio
+        self.f0_up_key = int(f0_up_key)
+        self.f0_method = f0_method
+        self.file_index = (
+            index_path.strip(" ")
+            .strip('"')
+            .strip("\n")
+            .strip('"')
+            .strip(" ")
+            .replace("trained", "added")
+        )
+        self.index_rate = float(index_rate)
+        self.protect = protect
+        self.filter_radius = int(filter_radius)
+        self.hop_length = int(hop_length)
+        self.sid = sid
+        # Requests can share a batch when everything past F0 is the same
+        self.key = (pth_file, self.file_index, self.index_rate, protect, sid)
+        self.submitted = ttime()
+        self.future = Future()
+
+
+class BatchScheduler:
+    """
+    Micro-batches concurrent conversions in front of an InferenceEngine.
+    The oldest pending request waits at most max_wait seconds for others
+    with the same voice and settings, up to max_batch requests. Each request
+    gets its own high-pass and F0, then the segments of all of them go
+    through the index and the synthesizer max_batch at a time, and every
+    caller gets its own audio back. Segments are batched with others of
+    about their length (VC.length_batches) and HuBERT only runs segments of
+    equal length together.
+
+    executor(function) runs a batch; the default runs it in the scheduler
+    thread. Pass one that goes through a job queue to share the engine with
+    other work.
+    """
+
+    def __init__(self, engine, max_batch=8, max_wait=0.02, executor=None):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.executor = executor or (lambda function: function())
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.batches = 0
+        self.requests = 0
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def submit(
+        self,
+        pth_file,
+        audio,
+        f0_up_key=0,
+        f0_method="rmvpe",
+        index_path="",
+        index_rate=0.75,
+        protect=0.33,
+        filter_radius=3,
+        hop_length=128,
+        sid=0,
+    ):
+        """
+        Queue a conversion. audio is 16 kHz float audio or anything
+        load_audio reads. Returns a Future of (tgt_sr, int16 audio).
+        """
+        request = ConversionRequest(
+            pth_file,
+            audio,
+            f0_up_key,
+            f0_method,
+            index_path,
+            index_rate,
+            protect,
+            filter_radius,
+            hop_length,
+            sid,
+        )
+        with self.condition:
+            self.pending.append(request)
+            self.condition.notify_all()
+        return request.future
+
+    def convert(self, *args, **kwargs):
+        return self.submit(*args, **kwargs).result()
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                first = self.pending[0]
+                deadline = first.submitted + self.max_wait
+                while True:
+                    batch = [
+                        request for request in self.pending if request.key == first.key
+                    ][: self.max_batch]
+                    remaining = deadline - ttime()
+                    if len(batch) >= self.max_batch or remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                for request in batch:
+                    self.pending.remove(request)
+                    metrics.observe("batch_wait", ttime() - request.submitted)
+            metrics.increment("batches")
+            metrics.increment("batched_requests", len(batch))
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                self.executor(lambda: self.run_batch(batch))
+            except Exception as error:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(error)
+
+    def run_batch(self, batch):
+        engine = self.engine
+        first = batch[0]
+        engine.get_vc(first.pth_file)
+        hubert_model = engine.load_hubert()
+        vc = engine.vc
+        if (
+            first.file_index != ""
+            and os.path.exists(first.file_index)
+            and first.index_rate != 0
+        ):
+            index, big_npy = vc.load_index(first.file_index)
+        else:
+            index = big_npy = None
+
+        prepared = []
+        for request in batch:
+            try:
+                audio = request.audio
+                if not isinstance(audio, np.ndarray):
+                    audio = load_audio(audio, 16000)
+                audio_max = np.abs(audio).max() / 0.95
+                if audio_max > 1:
+                    audio = audio / audio_max
+                audio, segments = vc.pipeline_segments(
+                    audio,
+                    None,
+                    request.f0_up_key,
+                    request.f0_method,
+                    engine.if_f0,
+                    request.filter_radius,
+                    request.hop_length,
+                )
+                prepared.append((request, audio, segments))
+            except Exception as error:
+                request.future.set_exception(error)
+
+        flat = [
+            (i, j, segment)
+            for i, (_, _, segments) in enumerate(prepared)
+            for j, segment in enumerate(segments)
+        ]
+        outputs = [[None] * len(segments) for _, _, segments in prepared]
+        sid = torch.tensor(first.sid, device=vc.device).unsqueeze(0).long()
+        for chunk in vc.length_batches(flat, self.max_batch):
+            results = vc.vc_batch(
+                hubert_model,
+                engine.net_g,
+                sid,
+                [segment for _, _, segment in chunk],
+                index,
+                big_npy,
+                first.index_rate,
+                engine.version,
+                first.protect,
+            )
+            for (i, j, _), audio1 in zip(chunk, results):
+                outputs[i][j] = audio1
+
+        for i, (request, audio, _) in enumerate(prepared):
+            audio_opt = vc.pipeline_output(audio, outputs[i], engine.tgt_sr, 0, 1)
+            request.future.set_result((engine.tgt_sr, audio_opt))
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+def load_test(scheduler, pth_file, audio, concurrency, requests, index_path=""):
+    """
+    Synthetic load: concurrency clients each send requests conversions of
+    audio back to back. Reports throughput and latency percentiles.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client():
+        for _ in range(requests):
+            # Scaled a little so every request misses the F0 cache
+            request_audio = audio * np.float32(1 - 1e-3 * np.random.rand())
+            t0 = ttime()
+            try:
+                scheduler.convert(pth_file, request_audio, index_path=index_path)
+            except Exception as error:
+                with lock:
+                    errors.append(str(error))
+                continue
+            with lock:
+                latencies.append(ttime() - t0)
+
+    batches, total = scheduler.batches, scheduler.requests
+    t0 = ttime()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = ttime() - t0
+
+    batches = scheduler.batches - batches
+    latencies = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        "concurrency": concurrency,
+        "requests": concurrency * requests,
+        "errors": len(errors),
+        "elapsed": elapsed,
+        "requests_per_second": concurrency * requests / elapsed,
+        "realtime_factor": concurrency * requests * audio.shape[0] / 16000 / elapsed,
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p99": float(np.percentile(latencies, 99)),
+        "mean_batch_size": (scheduler.requests - total) / batches if batches else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    from rvc.infer.infer import get_inference_engine
+
+    pth_file = sys.argv[1]
+    input_path = sys.argv[2]
+    concurrency = int(sys.argv[3])
+    requests = int(sys.argv[4])
+    max_batch = int(sys.argv[5])
+    max_wait = float(sys.argv[6])
+    index_path = sys.argv[7] if len(sys.argv) > 7 else ""
+
+    engine = get_inference_engine()
+    audio = load_audio(input_path, 16000)
+    results = {}
+    for name, batch_size in (("unbatched", 1), ("batched", max_batch)):
+        scheduler = BatchScheduler(engine, max_batch=batch_size, max_wait=max_wait)
+        # Warm up the models and caches outside of the measurement
+        scheduler.convert(pth_file, audio, index_path=index_path)
+        results[name] = load_test(
+            scheduler, pth_file, audio, concurrency, requests, index_path
+        )
+    print(json.dumps(results, indent=2))
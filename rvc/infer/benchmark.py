@@ -0,0 +1,795 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import platform
+from contextlib import contextmanager
+import numpy as np
+import soundfile as sf
+import torch
+import torch.nn as nn
+from multiprocessing import cpu_count
+from time import time as ttime
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+
+from rvc.configs.config import Config
+from rvc.infer.batching import BatchScheduler
+from rvc.infer.infer import InferenceEngine
+from rvc.lib.infer_pack.models import (
+    SynthesizerTrnMs256NSFsid,
+    SynthesizerTrnMs256NSFsid_nono,
+    SynthesizerTrnMs768NSFsid,
+    SynthesizerTrnMs768NSFsid_nono,
+)
+from rvc.lib.metrics import metrics
+from rvc.lib.rmvpe import RMVPE, E2E
+from rvc.lib.tools.split_audio import detect_nonsilent
+from rvc.lib.utils import load_audio, load_audio_ffmpeg
+from rvc.train.slicer import Slicer, get_rms
+
+# Largest int16 difference between a batched and an unbatched conversion,
+# batched matrix products may round differently
+max_batch_difference = 32
+# Chunked RMVPE and parallel harvest against a single pass: least share of
+# frames with the same voicing, largest 99th percentile deviation in cents
+min_voicing_agreement = 0.99
+max_cents_deviation = 50
+# Largest difference between the HuBERT features of a segment extracted in
+# a batch and on its own
+max_feature_difference = 1e-2
+
+suites = (
+    "pipeline",
+    "engine",
+    "batching",
+    "rmvpe",
+    "f0_parallel",
+    "decode",
+    "silence",
+    "slicer",
+)
+
+
+class SyntheticHubert(nn.Module):
+    """
+    Random-weight stand-in shaped like HuBERT base: the same convolutional
+    feature extractor (20 ms frames) with the GroupNorm over time after its
+    first convolution, 12 transformer layers of width 768 and final_proj,
+    so it costs about what the real model does and reacts to zero padding
+    the same way, without needing hubert_base.pt.
+    """
+
+    def __init__(self):
+        super().__init__()
+        layers = []
+        in_channels = 1
+        for kernel_size, stride in [(10, 5)] + [(3, 2)] * 4 + [(2, 2)] * 2:
+            layers.append(nn.Conv1d(in_channels, 512, kernel_size, stride, bias=False))
+            if in_channels == 1:
+                # fairseq's default mode normalizes each channel over the
+                # whole input after the first convolution
+                layers.append(nn.GroupNorm(512, 512))
+            layers.append(nn.GELU())
+            in_channels = 512
+        self.feature_extractor = nn.Sequential(*layers)
+        self.post_extract_proj = nn.Linear(512, 768)
+        self.layers = nn.ModuleList(
+            [
+                nn.TransformerEncoderLayer(768, 12, 3072, dropout=0.0, batch_first=True)
+                for _ in range(12)
+            ]
+        )
+        self.final_proj = nn.Linear(768, 256)
+
+    @staticmethod
+    def forward_padding_mask(features, padding_mask):
+        # As fairseq's HubertModel: a frame is padding when all its samples are
+        extra = padding_mask.size(1) % features.size(1)
+        if extra > 0:
+            padding_mask = padding_mask[:, :-extra]
+        padding_mask = padding_mask.view(padding_mask.size(0), features.size(1), -1)
+        return padding_mask.all(-1)
+
+    def extract_features(self, source, padding_mask=None, output_layer=None):
+        x = self.feature_extractor(source.unsqueeze(1)).transpose(1, 2)
+        x = self.post_extract_proj(x)
+        if padding_mask is not None:
+            padding_mask = self.forward_padding_mask(x, padding_mask)
+            x = x.masked_fill(padding_mask.unsqueeze(-1), 0)
+        for layer in self.layers[:output_layer]:
+            x = layer(x, src_key_padding_mask=padding_mask)
+        return x, padding_mask
+
+
+def synthetic_voice(path, version, sampling_rate, if_f0=1):
+    # Same checkpoint layout as rvc/train/process/extract_model.py
+    with open(os.path.join("rvc", "configs", version, f"{sampling_rate}.json")) as f:
+        hps = json.load(f)
+    data, model = hps["data"], hps["model"]
+    config = [
+        data["filter_length"] // 2 + 1,
+        32,
+        model["inter_channels"],
+        model["hidden_channels"],
+        model["filter_channels"],
+        model["n_heads"],
+        model["n_layers"],
+        model["kernel_size"],
+        model["p_dropout"],
+        model["resblock"],
+        model["resblock_kernel_sizes"],
+        model["resblock_dilation_sizes"],
+        model["upsample_rates"],
+        model["upsample_initial_channel"],
+        model["upsample_kernel_sizes"],
+        model["spk_embed_dim"],
+        model["gin_channels"],
+        data["sampling_rate"],
+    ]
+    if version == "v1":
+        synthesizer = (
+            SynthesizerTrnMs256NSFsid if if_f0 else SynthesizerTrnMs256NSFsid_nono
+        )
+    else:
+        synthesizer = (
+            SynthesizerTrnMs768NSFsid if if_f0 else SynthesizerTrnMs768NSFsid_nono
+        )
+    if if_f0:
+        net_g = synthesizer(*config, is_half=False)
+    else:
+        net_g = synthesizer(*config)
+    weight = {
+        key: value.half()
+        for key, value in net_g.state_dict().items()
+        if "enc_q" not in key
+    }
+    torch.save(
+        {
+            "weight": weight,
+            "config": config,
+            "info": "0epoch",
+            "sr": f"{sampling_rate // 1000}k",
+            "f0": if_f0,
+            "version": version,
+        },
+        path,
+    )
+
+
+def synthetic_index(path, dim, n_features=4096):
+    import faiss
+
+    big_npy = np.random.randn(n_features, dim).astype(np.float32)
+    n_ivf = min(int(16 * np.sqrt(n_features)), n_features // 39)
+    index = faiss.index_factory(dim, f"IVF{n_ivf},Flat")
+    faiss.extract_index_ivf(index).nprobe = 1
+    index.train(big_npy)
+    index.add(big_npy)
+    faiss.write_index(index, path)
+    np.save(os.path.splitext(path)[0] + ".npy", big_npy)
+
+
+def synthetic_rmvpe(path):
+    torch.save(E2E(4, 1, (2, 2)).state_dict(), path)
+
+
+def synthetic_speech(seconds, sr=44100, seed=0):
+    """Harmonic tone with a gliding pitch, syllable envelope and noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    f0 = 160 + 40 * np.sin(2 * np.pi * 0.3 * t) + 10 * np.sin(2 * np.pi * 5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    audio = sum(np.sin(k * phase) / k for k in range(1, 11))
+    envelope = np.clip(np.sin(2 * np.pi * 2 * t), 0, None) ** 0.5
+    audio = 0.3 * audio * envelope + 0.01 * rng.standard_normal(t.shape[0])
+    return audio.astype(np.float32)
+
+
+def synthetic_pauses(seconds, sr=16000, seed=0):
+    """Speech bursts of 0.5-10 s between digital silences of 0.1-3 s."""
+    rng = np.random.default_rng(seed)
+    speech = synthetic_speech(10, sr, seed)
+    length = int(seconds * sr)
+    pieces, total = [], 0
+    while total < length:
+        burst = speech[: rng.integers(sr // 2, speech.shape[0])]
+        pause = np.zeros(rng.integers(sr // 10, 3 * sr), dtype=np.float32)
+        pieces += [burst, pause]
+        total += burst.shape[0] + pause.shape[0]
+    return np.concatenate(pieces)[:length]
+
+
+@contextmanager
+def without_noise():
+    # The synthesizer samples its prior and the NSF excitation noise, with
+    # them zeroed conversions of the same input can be compared
+    randn_like, rand = torch.randn_like, torch.rand
+    torch.randn_like = lambda x, **kwargs: torch.zeros_like(x, **kwargs)
+    torch.rand = lambda *size, **kwargs: torch.zeros(*size, **kwargs)
+    try:
+        yield
+    finally:
+        torch.randn_like, torch.rand = randn_like, rand
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        scale = 1 if platform.system() == "Darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class PeakMemory:
+    """Samples the resident set size while the block runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_cuda = None
+
+    def sample(self):
+        while not self.stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+
+    def __enter__(self):
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self.start_rss = self.peak_rss = rss_bytes()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss, rss_bytes())
+        if torch.cuda.is_available():
+            self.peak_cuda = torch.cuda.max_memory_allocated()
+
+
+def stage_totals():
+    return {
+        stage: round(timing["total"], 4)
+        for stage, timing in metrics.summary()["stages"].items()
+    }
+
+
+class Benchmark:
+    def __init__(self, work_dir, real_models=False):
+        self.work_dir = work_dir
+        self.real_models = real_models
+        self.config = Config()
+        self.voices = {}
+        self.indexes = {}
+        self.audios = {}
+        if not real_models:
+            self.rmvpe_path = os.path.join(work_dir, "rmvpe.pt")
+            synthetic_rmvpe(self.rmvpe_path)
+        else:
+            self.rmvpe_path = "rmvpe.pt"
+
+    def new_engine(self):
+        engine = InferenceEngine(self.config)
+        if not self.real_models:
+            hubert_model = SyntheticHubert().to(self.config.device)
+            if self.config.is_half:
+                hubert_model = hubert_model.half()
+            engine.hubert_model = hubert_model.eval()
+            engine.model_rmvpe = RMVPE(
+                self.rmvpe_path, is_half=self.config.is_half, device=self.config.device
+            )
+        return engine
+
+    def voice(self, version):
+        if version not in self.voices:
+            path = os.path.join(self.work_dir, f"benchmark_{version}.pth")
+            synthetic_voice(path, version, 40000 if version == "v1" else 48000)
+            self.voices[version] = path
+        return self.voices[version]
+
+    def index(self, version):
+        if version not in self.indexes:
+            path = os.path.join(self.work_dir, f"added_benchmark_{version}.index")
+            synthetic_index(path, 256 if version == "v1" else 768)
+            self.indexes[version] = path
+        return self.indexes[version]
+
+    def audio(self, seconds, audio_format="WAV"):
+        key = (seconds, audio_format)
+        if key not in self.audios:
+            extension = audio_format.lower()
+            path = os.path.join(self.work_dir, f"input_{seconds}s.{extension}")
+            sf.write(path, synthetic_speech(seconds), 44100, format=audio_format)
+            self.audios[key] = path
+        return self.audios[key]
+
+    def convert(self, engine, version, seconds, f0method, with_index, batch_size=1):
+        output_path = os.path.join(self.work_dir, "output.wav")
+        index_path = self.index(version) if with_index else ""
+        # Every case extracts its own F0
+        engine.f0_cache.entries.clear()
+        metrics.reset()
+        with PeakMemory() as memory:
+            t0 = ttime()
+            result = engine.infer(
+                0,
+                3,
+                0.75,
+                128,
+                f0method,
+                self.audio(seconds),
+                output_path,
+                self.voice(version),
+                index_path,
+                batch_size=batch_size,
+            )
+            elapsed = ttime() - t0
+        if result is None:
+            raise RuntimeError(f"Conversion with {f0method} failed")
+        return {
+            "version": version,
+            "seconds": seconds,
+            "f0method": f0method,
+            "index": with_index,
+            "elapsed": round(elapsed, 4),
+            "realtime_factor": round(seconds / elapsed, 3),
+            "peak_rss": memory.peak_rss,
+            "peak_cuda": memory.peak_cuda,
+            "stages": stage_totals(),
+            "counters": metrics.summary()["counters"],
+        }
+
+    def pauses(self, seconds):
+        # Speech with digital silences, split mode converts every burst apart
+        key = (seconds, "pauses")
+        if key not in self.audios:
+            path = os.path.join(self.work_dir, f"pauses_{seconds}s.wav")
+            sf.write(path, synthetic_pauses(seconds), 16000)
+            self.audios[key] = path
+        return self.audios[key]
+
+    def batch_difference(self, engine, version, seconds, batch_size, split_audio=False):
+        # The same multi-segment input converted segment by segment and in
+        # batches of batch_size must give the same audio
+        input_path = self.pauses(seconds) if split_audio else self.audio(seconds)
+        outputs = []
+        for size in (1, batch_size):
+            engine.f0_cache.entries.clear()
+            with without_noise():
+                result = engine.infer(
+                    0,
+                    3,
+                    0.75,
+                    128,
+                    "pm",
+                    input_path,
+                    None,
+                    self.voice(version),
+                    "",
+                    split_audio=split_audio,
+                    batch_size=size,
+                )
+            if result is None:
+                raise RuntimeError(f"Conversion with batch size {size} failed")
+            outputs.append(result[1].astype(np.int32))
+        single, batched = outputs
+        if single.shape != batched.shape:
+            raise RuntimeError(
+                f"Batch size {batch_size} gave {batched.shape[0]} samples "
+                f"instead of {single.shape[0]}"
+            )
+        difference = int(np.abs(single - batched).max())
+        if difference > max_batch_difference:
+            raise RuntimeError(
+                f"Batch size {batch_size} differs by {difference} from batch size 1"
+            )
+        return difference
+
+    def feature_difference(self, engine, version, seconds):
+        # Per segment: the features of segments of different lengths
+        # extracted in one call must match extracting each one on its own
+        engine.get_vc(self.voice(version))
+        vc = engine.vc
+        hubert_model = engine.load_hubert()
+        audio = load_audio(self.audio(seconds), 16000)
+        audios = [audio, audio[: audio.shape[0] * 3 // 5], audio[: 16000 * 5], audio]
+        feats, n_frames = vc.extract_features(hubert_model, audios, version)
+        difference = 0.0
+        for i, audio0 in enumerate(audios):
+            single, single_frames = vc.extract_features(hubert_model, [audio0], version)
+            if n_frames[i] != single_frames[0]:
+                raise RuntimeError(
+                    f"Segment {i} got {n_frames[i]} feature frames in a batch "
+                    f"instead of {single_frames[0]}"
+                )
+            difference = max(
+                difference,
+                float(
+                    (feats[i, : n_frames[i]].float() - single[0].float()).abs().max()
+                ),
+            )
+        if difference > max_feature_difference:
+            raise RuntimeError(f"Batched HuBERT features differ by {difference}")
+        return {
+            "version": version,
+            "segments": len(audios),
+            "max_difference": difference,
+        }
+
+    def scheduler_difference(self, engine, version, seconds):
+        # Requests of different lengths sharing a micro-batch must give the
+        # same audio as each request converted on its own
+        audio = load_audio(self.audio(seconds), 16000)
+        requests = [audio, audio[: audio.shape[0] * 3 // 5], audio[: 16000 * 5]]
+        outputs = []
+        for max_batch in (1, len(requests)):
+            scheduler = BatchScheduler(engine, max_batch=max_batch, max_wait=1.0)
+            engine.f0_cache.entries.clear()
+            with without_noise():
+                futures = [
+                    scheduler.submit(self.voice(version), request, f0_method="pm")
+                    for request in requests
+                ]
+                outputs.append(
+                    [future.result()[1].astype(np.int32) for future in futures]
+                )
+        difference = 0
+        for single, batched in zip(*outputs):
+            if single.shape != batched.shape:
+                raise RuntimeError(
+                    f"Micro-batching gave {batched.shape[0]} samples "
+                    f"instead of {single.shape[0]}"
+                )
+            difference = max(difference, int(np.abs(single - batched).max()))
+        if difference > max_batch_difference:
+            raise RuntimeError(f"Micro-batching differs by {difference}")
+        return {
+            "version": version,
+            "requests": len(requests),
+            "max_difference": difference,
+        }
+
+    def pipeline(self, versions, f0methods, lengths):
+        engine = self.new_engine()
+        results = []
+        for version in versions:
+            # Warm up the models, the index cache and the allocator
+            self.convert(engine, version, min(lengths), "pm", True)
+            for f0method in f0methods:
+                for with_index in (False, True):
+                    for seconds in lengths:
+                        results.append(
+                            self.convert(engine, version, seconds, f0method, with_index)
+                        )
+                        print(
+                            f"{version} {f0method} index={with_index} {seconds}s: "
+                            f"{results[-1]['realtime_factor']}x realtime"
+                        )
+        return results
+
+    def engine(self, versions, seconds):
+        results = []
+        for version in versions:
+            # Cold: the voice model and its index are loaded from disk
+            engine = self.new_engine()
+            cold = self.convert(engine, version, seconds, "pm", True)
+            warm = self.convert(engine, version, seconds, "pm", True)
+            results.append(
+                {
+                    "version": version,
+                    "seconds": seconds,
+                    "cold": cold["elapsed"],
+                    "warm": warm["elapsed"],
+                    "cold_stages": cold["stages"],
+                }
+            )
+        return results
+
+    def batching(self, versions, seconds, batch_sizes=(1, 2, 4)):
+        engine = self.new_engine()
+        results = []
+        scheduler = []
+        features = []
+        for version in versions:
+            self.convert(engine, version, seconds, "pm", False)
+            features.append(self.feature_difference(engine, version, seconds))
+            scheduler.append(self.scheduler_difference(engine, version, seconds))
+            for batch_size in batch_sizes:
+                case = self.convert(engine, version, seconds, "pm", False, batch_size)
+                segments = case["counters"].get("segments", 0)
+                if segments == 0:
+                    raise RuntimeError(f"Batch size {batch_size} converted no segments")
+                difference = split_difference = 0
+                if batch_size > 1:
+                    difference = self.batch_difference(
+                        engine, version, seconds, batch_size
+                    )
+                    split_difference = self.batch_difference(
+                        engine, version, seconds, batch_size, split_audio=True
+                    )
+                results.append(
+                    {
+                        "version": version,
+                        "seconds": seconds,
+                        "batch_size": batch_size,
+                        "segments": segments,
+                        "elapsed": case["elapsed"],
+                        "segments_per_second": round(segments / case["elapsed"], 3),
+                        "max_difference": difference,
+                        "split_max_difference": split_difference,
+                        "peak_rss": case["peak_rss"],
+                        "peak_cuda": case["peak_cuda"],
+                    }
+                )
+        return {"batch_sizes": results, "features": features, "scheduler": scheduler}
+
+    def rmvpe(self, minutes, lengths):
+        model = RMVPE(
+            self.rmvpe_path, is_half=self.config.is_half, device=self.config.device
+        )
+        decode = []
+        for length in minutes:
+            n_frames = int(length * 60 * 100)
+            hidden = np.random.rand(n_frames, 360).astype(np.float32)
+            t0 = ttime()
+            model.decode(hidden)
+            decode.append(
+                {"minutes": length, "frames": n_frames, "elapsed": ttime() - t0}
+            )
+            del hidden
+
+        chunked = []
+        for seconds in lengths:
+            audio = load_audio(self.audio(seconds), 16000)
+            n_frames = audio.shape[0] // 160 + 1
+            f0s = []
+            for chunk_size in (None, max(32, n_frames // 8)):
+                model.chunk_size = (
+                    None if chunk_size is None else -(-chunk_size // 32) * 32
+                )
+                with PeakMemory() as memory:
+                    t0 = ttime()
+                    f0s.append(model.infer_from_audio(audio))
+                    elapsed = ttime() - t0
+                chunked.append(
+                    {
+                        "seconds": seconds,
+                        "chunk_size": model.chunk_size,
+                        "elapsed": elapsed,
+                        "peak_rss": memory.peak_rss,
+                        "rss_increase": memory.peak_rss - memory.start_rss,
+                        "peak_cuda": memory.peak_cuda,
+                    }
+                )
+            chunked[-1].update(self.f0_deviation(*f0s, f"Chunked RMVPE at {seconds}s"))
+        return {"decode": decode, "chunked": chunked}
+
+    @staticmethod
+    def f0_deviation(reference, f0, name):
+        # Voicing agreement and cents deviation of f0 against reference,
+        # raises on a length difference or past min_voicing_agreement or
+        # max_cents_deviation
+        length_difference = abs(reference.shape[0] - f0.shape[0])
+        n = min(reference.shape[0], f0.shape[0])
+        reference, f0 = reference[:n], f0[:n]
+        voiced = (reference > 0) & (f0 > 0)
+        cents = 1200 * np.abs(np.log2(f0[voiced] / reference[voiced]))
+        deviation = {
+            "frames_length_difference": int(length_difference),
+            "voicing_agreement": float(np.mean((reference > 0) == (f0 > 0))),
+            "max_cents": float(cents.max()) if cents.size else 0.0,
+            "p99_cents": float(np.percentile(cents, 99)) if cents.size else 0.0,
+            "mean_cents": float(cents.mean()) if cents.size else 0.0,
+        }
+        if length_difference:
+            raise RuntimeError(f"{name} differs by {length_difference} frames")
+        if deviation["voicing_agreement"] < min_voicing_agreement:
+            raise RuntimeError(
+                f"{name} agrees on voicing for {deviation['voicing_agreement']:.4f} "
+                f"of the frames, below {min_voicing_agreement}"
+            )
+        if deviation["p99_cents"] > max_cents_deviation:
+            raise RuntimeError(
+                f"{name} deviates by {deviation['p99_cents']:.1f} cents "
+                f"(99th percentile), above {max_cents_deviation}"
+            )
+        return deviation
+
+    def f0_parallel(self, seconds, processes):
+        engine = self.new_engine()
+        engine.get_vc(self.voice("v2"))
+        vc = engine.vc
+        audio, _ = vc.preprocess(load_audio(self.audio(seconds), 16000))
+        audio_pad = np.pad(audio, (vc.t_pad, vc.t_pad), mode="reflect")
+        p_len = audio_pad.shape[0] // vc.window
+
+        t0 = ttime()
+        single = vc.compute_f0(audio_pad, p_len, "harvest", 3, 128, 1)
+        single_time = ttime() - t0
+        t0 = ttime()
+        parallel = vc.compute_f0(audio_pad, p_len, "harvest", 3, 128, processes)
+        parallel_time = ttime() - t0
+
+        result = {
+            "seconds": seconds,
+            "processes": processes,
+            "single": single_time,
+            "parallel": parallel_time,
+            "speedup": single_time / parallel_time if parallel_time > 0 else 0.0,
+        }
+        result.update(self.f0_deviation(single, parallel, "Parallel harvest"))
+        return result
+
+    def decode(self, seconds, repeats=5):
+        results = []
+        for audio_format in ("WAV", "FLAC"):
+            path = self.audio(seconds, audio_format)
+            for name, decoder in (
+                ("in_process", load_audio),
+                ("ffmpeg", load_audio_ffmpeg),
+            ):
+                try:
+                    t0 = ttime()
+                    for _ in range(repeats):
+                        decoder(path, 16000)
+                    elapsed = (ttime() - t0) / repeats
+                except Exception as error:
+                    results.append(
+                        {"format": audio_format, "decoder": name, "error": str(error)}
+                    )
+                    continue
+                results.append(
+                    {
+                        "format": audio_format,
+                        "decoder": name,
+                        "seconds": seconds,
+                        "elapsed": elapsed,
+                        "realtime_factor": seconds / elapsed,
+                    }
+                )
+        return results
+
+    def silence(self, minutes, sr=16000):
+        pcm = (synthetic_pauses(minutes * 60, sr) * 32767).astype(np.int16)
+        t0 = ttime()
+        regions = detect_nonsilent(pcm, sr, -70, 750)
+        elapsed = ttime() - t0
+        result = {
+            "minutes": minutes,
+            "regions": len(regions),
+            "elapsed": elapsed,
+            "realtime_factor": minutes * 60 / elapsed,
+        }
+        try:
+            from pydub import AudioSegment
+            from pydub.silence import detect_nonsilent as pydub_detect_nonsilent
+        except ImportError:
+            result["pydub_error"] = "pydub is not installed"
+            return result
+        song = AudioSegment(pcm.tobytes(), frame_rate=sr, sample_width=2, channels=1)
+        t0 = ttime()
+        pydub_regions = pydub_detect_nonsilent(
+            song, min_silence_len=750, silence_thresh=-70
+        )
+        pydub_elapsed = ttime() - t0
+        result.update(
+            {
+                "pydub_elapsed": pydub_elapsed,
+                "speedup": pydub_elapsed / elapsed if elapsed > 0 else 0.0,
+                "same_regions": regions == [tuple(part) for part in pydub_regions],
+            }
+        )
+        return result
+
+    def slicer(self, minutes=(1, 5, 10), sr=40000):
+        # The settings of the training set preprocessing
+        slicer = Slicer(
+            sr=sr,
+            threshold=-42,
+            min_length=1500,
+            min_interval=400,
+            hop_size=15,
+            max_sil_kept=500,
+        )
+        results = []
+        for length in minutes:
+            audio = synthetic_pauses(length * 60, sr)
+            t0 = ttime()
+            rms_list = get_rms(
+                y=audio, frame_length=slicer.win_size, hop_length=slicer.hop_size
+            ).squeeze(0)
+            rms_time = ttime() - t0
+            t0 = ttime()
+            sil_tags = slicer._sil_tags(rms_list)
+            tags_time = ttime() - t0
+            t0 = ttime()
+            chunks = slicer.slice(audio)
+            elapsed = ttime() - t0
+            results.append(
+                {
+                    "minutes": length,
+                    "frames": int(rms_list.shape[0]),
+                    "silences": len(sil_tags),
+                    "chunks": len(chunks),
+                    "rms_time": rms_time,
+                    "boundaries_time": tags_time,
+                    "elapsed": elapsed,
+                    "realtime_factor": length * 60 / elapsed,
+                }
+            )
+        return results
+
+
+def run_benchmark(
+    suites=suites,
+    versions=("v1", "v2"),
+    f0methods=("pm", "dio", "harvest", "rmvpe"),
+    lengths=(5, 30, 120),
+    rmvpe_minutes=(1, 15, 60),
+    f0_processes=None,
+    long_minutes=60,
+    real_models=False,
+    output_path=None,
+):
+    """
+    Runs the selected suites on CPU or the configured device and returns the
+    results as a dict, also written as JSON to output_path when given. With
+    real_models=False HuBERT, RMVPE, the voices and the indexes are random
+    weight stand-ins, so no download is needed.
+    """
+    work_dir = tempfile.mkdtemp(prefix="rvc_benchmark_")
+    try:
+        benchmark = Benchmark(work_dir, real_models)
+        config = benchmark.config
+        results = {
+            "environment": {
+                "device": config.device,
+                "is_half": config.is_half,
+                "cpu_count": cpu_count(),
+                "torch": torch.__version__,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "real_models": real_models,
+            }
+        }
+        longest = max(lengths)
+        for suite in suites:
+            print(f"Running the {suite} benchmark")
+            t0 = ttime()
+            if suite == "pipeline":
+                results[suite] = benchmark.pipeline(versions, f0methods, lengths)
+            elif suite == "engine":
+                results[suite] = benchmark.engine(versions, min(lengths))
+            elif suite == "batching":
+                results[suite] = benchmark.batching(versions, longest)
+            elif suite == "rmvpe":
+                results[suite] = benchmark.rmvpe(rmvpe_minutes, lengths)
+            elif suite == "f0_parallel":
+                results[suite] = benchmark.f0_parallel(
+                    min(longest, 60), f0_processes or min(cpu_count(), 8)
+                )
+            elif suite == "decode":
+                results[suite] = benchmark.decode(longest)
+            elif suite == "silence":
+                results[suite] = benchmark.silence(long_minutes)
+            elif suite == "slicer":
+                results[suite] = benchmark.slicer()
+            else:
+                raise ValueError(f"Unknown benchmark suite: {suite}")
+            print(f"Finished the {suite} benchmark in {ttime() - t0:.1f}s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
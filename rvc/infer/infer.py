@@ -1,12 +1,19 @@
 import os
 import sys
 import torch
+from collections import OrderedDict
 import numpy as np
 import soundfile as sf
-from vc_infer_pipeline import VC
+from time import time as ttime
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+
+from fairseq import checkpoint_utils
+from rvc.infer.vc_infer_pipeline import VC, F0Cache, FeatureCache
 from rvc.lib.utils import load_audio
+from rvc.lib.metrics import metrics
 from rvc.lib.tools.split_audio import process_audio, merge_audio
-from fairseq import checkpoint_utils
 from rvc.lib.infer_pack.models import (
     SynthesizerTrnMs256NSFsid,
     SynthesizerTrnMs256NSFsid_nono,
@@ -16,250 +23,510 @@ from rvc.lib.infer_pack.models import (
 
 from rvc.configs.config import Config
 
-config = Config()
-
 torch.manual_seed(114514)
-hubert_model = None
-
-
-def load_hubert():
-    global hubert_model
-    models, _, _ = checkpoint_utils.load_model_ensemble_and_task(
-        ["hubert_base.pt"],
-        suffix="",
-    )
-    hubert_model = models[0]
-    hubert_model = hubert_model.to(config.device)
-    if config.is_half:
-        hubert_model = hubert_model.half()
-    else:
-        hubert_model = hubert_model.float()
-    hubert_model.eval()
-
-
-def vc_single(
-    sid=0,
-    input_audio_path=None,
-    f0_up_key=None,
-    f0_file=None,
-    f0_method=None,
-    file_index=None,
-    index_rate=None,
-    resample_sr=0,
-    rms_mix_rate=1,
-    protect=0.33,
-    hop_length=None,
-    output_path=None,
-    split_audio=False,
-):
-    global tgt_sr, net_g, vc, hubert_model, version
-
-    if input_audio_path is None:
-        return "Please, load an audio!", None
-
-    f0_up_key = int(f0_up_key)
-    try:
-        audio = load_audio(input_audio_path, 16000)
-        audio_max = np.abs(audio).max() / 0.95
 
-        if audio_max > 1:
-            audio /= audio_max
 
-        if not hubert_model:
-            load_hubert()
+class VoiceModel:
+    def __init__(self, net_g, vc, tgt_sr, if_f0, version, n_spk, mtime):
+        self.net_g = net_g
+        self.vc = vc
+        self.tgt_sr = tgt_sr
+        self.if_f0 = if_f0
+        self.version = version
+        self.n_spk = n_spk
+        self.mtime = mtime
+
+    @property
+    def size_bytes(self):
+        size = sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in self.net_g.state_dict().values()
+        )
+        if self.vc.index is not None:
+            # IVF,Flat keeps every vector it holds as float32
+            size += self.vc.index.ntotal * self.vc.index.d * 4
+        if self.vc.big_npy is not None:
+            # A memory-mapped sidecar is counted whole: the rows gathered
+            # after each search stay paged in
+            size += self.vc.big_npy.nbytes
+        return size
+
+
+class ModelCache:
+    """
+    LRU cache of loaded voice models keyed by .pth path. An entry is only
+    reused while the file's mtime is unchanged. The cache is bounded by
+    model count and, optionally, by the total size in bytes of the
+    generator weights, faiss indexes and index features it holds.
+    """
+
+    def __init__(self, max_models=4, max_bytes=None):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, pth_path):
+        key = os.path.abspath(pth_path)
+        model = self.models.get(key)
+        if model is not None and model.mtime == os.path.getmtime(key):
+            self.models.move_to_end(key)
+            self.hits += 1
+            metrics.increment("cache_hits", cache="model")
+            return model
+        if model is not None:
+            del self.models[key]
+        self.misses += 1
+        metrics.increment("cache_misses", cache="model")
+        return None
+
+    def put(self, pth_path, model):
+        key = os.path.abspath(pth_path)
+        self.models[key] = model
+        self.models.move_to_end(key)
+        self.shrink()
+
+    def shrink(self):
+        # The most recently used model is never evicted
+        while len(self.models) > 1 and (
+            len(self.models) > self.max_models
+            or (self.max_bytes is not None and self.size_bytes > self.max_bytes)
+        ):
+            key, _ = self.models.popitem(last=False)
+            self.evictions += 1
+            print(f"Evicted voice model {key} from cache")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    @property
+    def size_bytes(self):
+        return sum(model.size_bytes for model in self.models.values())
+
+    def stats(self):
+        return {
+            "models": len(self.models),
+            "size_bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class InferenceEngine:
+    """
+    Keeps HuBERT, the VC pipeline (with its RMVPE model) and recently used
+    voice models with their faiss indexes loaded between conversions, so
+    only the first call for a given voice pays the loading cost.
+    """
+
+    def __init__(
+        self,
+        config=None,
+        max_models=4,
+        max_cache_bytes=None,
+        f0_cache_dir=None,
+        f0_cache_entries=256,
+        feature_cache_dir=None,
+        feature_cache_bytes=2 * 1024**3,
+    ):
+        self.config = config if config is not None else Config()
+        self.f0_cache = F0Cache(f0_cache_entries, f0_cache_dir)
+        self.feature_cache = FeatureCache(feature_cache_dir, feature_cache_bytes)
+        self.hubert_model = None
+        self.model_rmvpe = None
+        self.model_cache = ModelCache(max_models, max_cache_bytes)
+        self.model_path = None
+        self.net_g = None
+        self.vc = None
+        self.tgt_sr = None
+        self.if_f0 = None
+        self.version = None
+        self.n_spk = None
+
+    def load_hubert(self):
+        if self.hubert_model is not None:
+            return self.hubert_model
+        models, _, _ = checkpoint_utils.load_model_ensemble_and_task(
+            ["hubert_base.pt"],
+            suffix="",
+        )
+        hubert_model = models[0]
+        hubert_model = hubert_model.to(self.config.device)
+        if self.config.is_half:
+            hubert_model = hubert_model.half()
+        else:
+            hubert_model = hubert_model.float()
+        hubert_model.eval()
+        self.hubert_model = hubert_model
+        return hubert_model
+
+    def set_f0_cache(self, cache_dir, max_entries=256):
+        """
+        Also keep F0 curves in cache_dir, None keeps them in memory only.
+        The curves already in memory are kept when only the folder changes.
+        """
+        cache = self.f0_cache
+        if cache.cache_dir != cache_dir or cache.max_entries != max_entries:
+            self.f0_cache = F0Cache(max_entries, cache_dir)
+            self.f0_cache.entries = OrderedDict(
+                list(cache.entries.items())[-max_entries:]
+            )
+
+    def set_feature_cache(self, cache_dir, max_bytes=2 * 1024**3):
+        """
+        Keep HuBERT features in cache_dir, up to max_bytes; None disables
+        the cache. Takes effect from the next conversion.
+        """
+        cache = self.feature_cache
+        if cache.cache_dir != cache_dir or cache.max_bytes != max_bytes:
+            self.feature_cache = FeatureCache(cache_dir, max_bytes)
+
+    def load_model(self, weight_root):
+        mtime = os.path.getmtime(weight_root)
+        cpt = torch.load(weight_root, map_location="cpu")
+        tgt_sr = cpt["config"][-1]
+        cpt["config"][-3] = cpt["weight"]["emb_g.weight"].shape[0]
         if_f0 = cpt.get("f0", 1)
 
-        file_index = (
-            file_index.strip(" ")
-            .strip('"')
-            .strip("\n")
-            .strip('"')
-            .strip(" ")
-            .replace("trained", "added")
+        version = cpt.get("version", "v1")
+        if version == "v1":
+            if if_f0 == 1:
+                net_g = SynthesizerTrnMs256NSFsid(
+                    *cpt["config"], is_half=self.config.is_half
+                )
+            else:
+                net_g = SynthesizerTrnMs256NSFsid_nono(*cpt["config"])
+        elif version == "v2":
+            if if_f0 == 1:
+                net_g = SynthesizerTrnMs768NSFsid(
+                    *cpt["config"], is_half=self.config.is_half
+                )
+            else:
+                net_g = SynthesizerTrnMs768NSFsid_nono(*cpt["config"])
+        del net_g.enc_q
+        print(net_g.load_state_dict(cpt["weight"], strict=False))
+        net_g.eval().to(self.config.device)
+        if self.config.is_half:
+            net_g = net_g.half()
+        else:
+            net_g = net_g.float()
+
+        return VoiceModel(
+            net_g,
+            VC(tgt_sr, self.config),
+            tgt_sr,
+            if_f0,
+            version,
+            cpt["config"][-3],
+            mtime,
         )
-        if tgt_sr != resample_sr >= 16000:
-            tgt_sr = resample_sr
-        if split_audio:
-            result, new_dir_path = process_audio(input_audio_path)
-            if result == "Error":
-                return "Error with Split Audio", None
-            dir_path = (
-                new_dir_path.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
+
+    def get_vc(self, weight_root):
+        model = self.model_cache.get(weight_root)
+        if model is None:
+            with metrics.timer("model_load"):
+                model = self.load_model(weight_root)
+            self.model_cache.put(weight_root, model)
+            stats = self.model_cache.stats()
+            print(
+                f"Loaded voice model {weight_root} "
+                f"(cache hits: {stats['hits']}, misses: {stats['misses']})"
             )
-            if dir_path != "":
-                paths = [
-                    os.path.join(root, name)
-                    for root, _, files in os.walk(dir_path, topdown=False)
-                    for name in files
-                    if name.endswith(".wav") and root == dir_path
-                ]
-            try:
-                for path in paths:
-                    info, opt = vc_single(
-                        sid,
-                        path,
-                        f0_up_key,
-                        None,
-                        f0_method,
-                        file_index,
-                        index_rate,
-                        resample_sr,
-                        rms_mix_rate,
-                        protect,
-                        hop_length,
-                        path,
-                        False,
-                    )
-                    # new_dir_path
-            except Exception as error:
-                print(error)
-                return "Error", None
-            print("Finished processing segmented audio, now merging audio...")
-            merge_timestamps_file = os.path.join(
-                os.path.dirname(new_dir_path),
-                f"{os.path.basename(input_audio_path).split('.')[0]}_timestamps.txt",
+
+        # RMVPE does not depend on the voice model, share it across voices
+        if self.vc is not None and hasattr(self.vc, "model_rmvpe"):
+            self.model_rmvpe = self.vc.model_rmvpe
+        if self.model_rmvpe is not None:
+            model.vc.model_rmvpe = self.model_rmvpe
+        model.vc.f0_cache = self.f0_cache
+        model.vc.feature_cache = self.feature_cache
+
+        self.net_g = model.net_g
+        self.vc = model.vc
+        self.tgt_sr = model.tgt_sr
+        self.if_f0 = model.if_f0
+        self.version = model.version
+        self.n_spk = model.n_spk
+        self.model_path = weight_root
+
+    def vc_single(
+        self,
+        sid=0,
+        input_audio_path=None,
+        f0_up_key=None,
+        f0_file=None,
+        f0_method=None,
+        file_index=None,
+        index_rate=None,
+        resample_sr=0,
+        rms_mix_rate=1,
+        protect=0.33,
+        hop_length=None,
+        output_path=None,
+        split_audio=False,
+        filter_radius=3,
+        batch_size=1,
+        f0_processes=1,
+    ):
+        if input_audio_path is None:
+            return "Please, load an audio!", None
+
+        f0_up_key = int(f0_up_key)
+        try:
+            audio = load_audio(input_audio_path, 16000)
+            audio_max = np.abs(audio).max() / 0.95
+
+            if audio_max > 1:
+                audio /= audio_max
+
+            hubert_model = self.load_hubert()
+
+            file_index = (
+                file_index.strip(" ")
+                .strip('"')
+                .strip("\n")
+                .strip('"')
+                .strip(" ")
+                .replace("trained", "added")
             )
-            tgt_sr, audio_opt = merge_audio(merge_timestamps_file)
+            tgt_sr = self.tgt_sr
+            if tgt_sr != resample_sr >= 16000:
+                tgt_sr = resample_sr
+            if str(split_audio) == "True":
+                # Non-silent regions are converted as views of the decoded
+                # audio and written back at their offsets
+                regions = process_audio(audio, 16000)
+                chunks = self.vc.pipeline_chunks(
+                    hubert_model,
+                    self.net_g,
+                    sid,
+                    [audio[start:end] for start, end in regions],
+                    f0_up_key,
+                    f0_method,
+                    file_index,
+                    index_rate,
+                    self.if_f0,
+                    filter_radius,
+                    self.tgt_sr,
+                    resample_sr,
+                    rms_mix_rate,
+                    self.version,
+                    protect,
+                    hop_length,
+                    batch_size=batch_size,
+                    f0_processes=f0_processes,
+                )
+                audio_opt = merge_audio(chunks, regions, audio.shape[0], 16000, tgt_sr)
 
-        else:
-            audio_opt = vc.pipeline(
+            else:
+                audio_opt = self.vc.pipeline(
+                    hubert_model,
+                    self.net_g,
+                    sid,
+                    audio,
+                    input_audio_path,
+                    f0_up_key,
+                    f0_method,
+                    file_index,
+                    index_rate,
+                    self.if_f0,
+                    filter_radius,
+                    self.tgt_sr,
+                    resample_sr,
+                    rms_mix_rate,
+                    self.version,
+                    protect,
+                    hop_length,
+                    f0_file=f0_file,
+                    batch_size=batch_size,
+                    f0_processes=f0_processes,
+                )
+            # The index is only loaded during the conversion, so the byte
+            # budget is checked once it is counted
+            if self.model_cache.max_bytes is not None:
+                self.model_cache.shrink()
+
+            if output_path is not None:
+                with metrics.timer("encode"):
+                    sf.write(output_path, audio_opt, tgt_sr, format="WAV")
+
+            return (tgt_sr, audio_opt)
+
+        except Exception as error:
+            print(error)
+
+    def infer(
+        self,
+        f0up_key,
+        filter_radius,
+        index_rate,
+        hop_length,
+        f0method,
+        input_path,
+        output_path,
+        pth_file,
+        index_path,
+        split_audio=False,
+        batch_size=1,
+        f0_processes=1,
+    ):
+        self.get_vc(pth_file)
+        return self.vc_single(
+            sid=0,
+            input_audio_path=input_path,
+            f0_up_key=f0up_key,
+            f0_file=None,
+            f0_method=f0method,
+            file_index=index_path,
+            index_rate=float(index_rate),
+            hop_length=hop_length,
+            output_path=output_path,
+            split_audio=split_audio,
+            filter_radius=filter_radius,
+            batch_size=int(batch_size),
+            f0_processes=int(f0_processes),
+        )
+
+    def fan_out(
+        self,
+        input_path,
+        targets,
+        f0method,
+        filter_radius=3,
+        hop_length=128,
+        batch_size=1,
+        f0_processes=1,
+    ):
+        """
+        Convert one input through several voices. Decoding, the high-pass
+        filter, the split points, F0 (through the F0 cache, before each
+        voice's pitch shift) and the HuBERT features of each model version
+        are computed once; every target only pays for the index blend and
+        the synthesizer. targets is a list of dicts with pth_file,
+        index_path, output_path and optional f0up_key and index_rate.
+        """
+        if not targets:
+            raise ValueError("fan_out needs at least one target voice")
+        t0 = ttime()
+        audio = load_audio(input_path, 16000)
+        audio_max = np.abs(audio).max() / 0.95
+        if audio_max > 1:
+            audio /= audio_max
+        hubert_model = self.load_hubert()
+        decode_time = ttime() - t0
+
+        front = None
+        feature_memo = {}
+        target_times = []
+        for target in targets:
+            self.get_vc(target["pth_file"])
+            t1 = ttime()
+            if front is None:
+                front = self.vc.preprocess(audio)
+            file_index = (
+                target.get("index_path", "")
+                .strip(" ")
+                .strip('"')
+                .strip("\n")
+                .strip('"')
+                .strip(" ")
+                .replace("trained", "added")
+            )
+            audio_opt = self.vc.pipeline(
                 hubert_model,
-                net_g,
-                sid,
+                self.net_g,
+                0,
                 audio,
-                input_audio_path,
-                f0_up_key,
-                f0_method,
+                input_path,
+                int(target.get("f0up_key", 0)),
+                f0method,
                 file_index,
-                index_rate,
-                if_f0,
+                float(target.get("index_rate", 0.75)),
+                self.if_f0,
                 filter_radius,
-                tgt_sr,
-                resample_sr,
-                rms_mix_rate,
-                version,
-                protect,
+                self.tgt_sr,
+                0,
+                1,
+                self.version,
+                0.33,
                 hop_length,
-                f0_file=f0_file,
+                batch_size=batch_size,
+                f0_processes=f0_processes,
+                front=front,
+                feature_memo=feature_memo,
             )
+            if self.model_cache.max_bytes is not None:
+                self.model_cache.shrink()
+            with metrics.timer("encode"):
+                sf.write(target["output_path"], audio_opt, self.tgt_sr, format="WAV")
+            target_times.append(ttime() - t1)
+            print(f"Converted {input_path} with {target['pth_file']}")
 
-        if output_path is not None:
-            sf.write(output_path, audio_opt, tgt_sr, format="WAV")
+        # Not measured: the first target paid the full front end, so N
+        # independent runs are estimated at N times the decode and the first
+        # target
+        total_time = ttime() - t0
+        estimated_independent_time = len(targets) * (decode_time + target_times[0])
+        estimated_speedup = (
+            estimated_independent_time / total_time if total_time > 0 else 0.0
+        )
+        print(
+            f"Fan-out of {len(targets)} voices took {total_time:.2f}s, "
+            f"independent runs estimated at {estimated_independent_time:.2f}s "
+            f"from the first voice ({estimated_speedup:.2f}x estimated speedup)"
+        )
+        return {
+            "total_time": total_time,
+            "target_times": target_times,
+            "estimated_independent_time": estimated_independent_time,
+            "estimated_speedup": estimated_speedup,
+        }
+
+
+inference_engine = None
+
+
+def get_inference_engine():
+    global inference_engine
+    if inference_engine is None:
+        inference_engine = InferenceEngine()
+    return inference_engine
 
-        return (tgt_sr, audio_opt)
+
+if __name__ == "__main__":
+    f0up_key = sys.argv[1]
+    filter_radius = sys.argv[2]
+    index_rate = float(sys.argv[3])
+    hop_length = sys.argv[4]
+    f0method = sys.argv[5]
+
+    audio_input_path = sys.argv[6]
+    audio_output_path = sys.argv[7]
+
+    model_path = sys.argv[8]
+    index_path = sys.argv[9]
+
+    try:
+        split_audio = sys.argv[10]
+    except IndexError:
+        split_audio = None
+
+    try:
+        result, audio_opt = get_inference_engine().infer(
+            f0up_key,
+            filter_radius,
+            index_rate,
+            hop_length,
+            f0method,
+            audio_input_path,
+            audio_output_path,
+            model_path,
+            index_path,
+            split_audio,
+        )
+        print(f"Conversion completed. Output file: '{audio_output_path}'")
 
     except Exception as error:
-        print(error)
-
-
-def get_vc(weight_root, sid):
-    global n_spk, tgt_sr, net_g, vc, cpt, version
-    if sid == "" or sid == []:
-        global hubert_model
-        if hubert_model is not None:
-            print("clean_empty_cache")
-            del net_g, n_spk, vc, hubert_model, tgt_sr  # ,cpt
-            hubert_model = net_g = n_spk = vc = hubert_model = tgt_sr = None
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-
-            if_f0 = cpt.get("f0", 1)
-            version = cpt.get("version", "v1")
-            if version == "v1":
-                if if_f0 == 1:
-                    net_g = SynthesizerTrnMs256NSFsid(
-                        *cpt["config"], is_half=config.is_half
-                    )
-                else:
-                    net_g = SynthesizerTrnMs256NSFsid_nono(*cpt["config"])
-            elif version == "v2":
-                if if_f0 == 1:
-                    net_g = SynthesizerTrnMs768NSFsid(
-                        *cpt["config"], is_half=config.is_half
-                    )
-                else:
-                    net_g = SynthesizerTrnMs768NSFsid_nono(*cpt["config"])
-            del net_g, cpt
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            cpt = None
-    person = weight_root
-    cpt = torch.load(person, map_location="cpu")
-    tgt_sr = cpt["config"][-1]
-    cpt["config"][-3] = cpt["weight"]["emb_g.weight"].shape[0]
-    if_f0 = cpt.get("f0", 1)
-
-    version = cpt.get("version", "v1")
-    if version == "v1":
-        if if_f0 == 1:
-            net_g = SynthesizerTrnMs256NSFsid(*cpt["config"], is_half=config.is_half)
-        else:
-            net_g = SynthesizerTrnMs256NSFsid_nono(*cpt["config"])
-    elif version == "v2":
-        if if_f0 == 1:
-            net_g = SynthesizerTrnMs768NSFsid(*cpt["config"], is_half=config.is_half)
-        else:
-            net_g = SynthesizerTrnMs768NSFsid_nono(*cpt["config"])
-    del net_g.enc_q
-    print(net_g.load_state_dict(cpt["weight"], strict=False))
-    net_g.eval().to(config.device)
-    if config.is_half:
-        net_g = net_g.half()
-    else:
-        net_g = net_g.float()
-    vc = VC(tgt_sr, config)
-    n_spk = cpt["config"][-3]
-
-
-f0up_key = sys.argv[1]
-filter_radius = sys.argv[2]
-index_rate = float(sys.argv[3])
-hop_length = sys.argv[4]
-f0method = sys.argv[5]
-
-audio_input_path = sys.argv[6]
-audio_output_path = sys.argv[7]
-
-model_path = sys.argv[8]
-index_path = sys.argv[9]
-
-try:
-    split_audio = sys.argv[10]
-except IndexError:
-    split_audio = None
-
-sid = f0up_key
-input_audio = audio_input_path
-f0_pitch = f0up_key
-f0_file = None
-f0_method = f0method
-file_index = index_path
-index_rate = index_rate
-output_file = audio_output_path
-split_audio = split_audio
-
-get_vc(model_path, 0)
-
-try:
-    result, audio_opt = vc_single(
-        sid=0,
-        input_audio_path=input_audio,
-        f0_up_key=f0_pitch,
-        f0_file=None,
-        f0_method=f0_method,
-        file_index=file_index,
-        index_rate=index_rate,
-        hop_length=hop_length,
-        output_path=output_file,
-        split_audio=split_audio,
-    )
-
-    if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
-        message = result
-    else:
-        message = result
-
-    print(f"Conversion completed. Output file: '{output_file}'")
-
-except Exception as error:
-    print(f"Voice conversion failed: {error}")
+        print(f"Voice conversion failed: {error}")
@@ -0,0 +1,240 @@
+import os
+import sys
+import numpy as np
+import soundfile as sf
+import torch
+from time import time as ttime
+from scipy import signal
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+
+from rvc.infer.vc_infer_pipeline import bh, ah
+from rvc.lib.utils import load_audio
+
+# Largest boundary_discontinuity stream_file accepts, a block boundary may
+# step at most twice as far as any step inside the blocks
+max_discontinuity = 2.0
+
+
+class StreamingConverter:
+    """
+    Converts 16 kHz mono float PCM as it arrives. Every block is converted
+    together with a rolling window of past audio (context) so HuBERT and the
+    F0 estimator see enough signal, but the synthesizer only renders the
+    tail covering the new block, the crossfade and the lookahead. Output
+    blocks are joined with a crossfade, so the emitted stream is continuous.
+
+    Times are in seconds and rounded to the 10 ms feature frame.
+    """
+
+    sr = 16000
+    window = 160
+
+    def __init__(
+        self,
+        engine,
+        pth_file,
+        index_path="",
+        f0_up_key=0,
+        f0_method="rmvpe",
+        index_rate=0.75,
+        protect=0.33,
+        block_time=0.25,
+        crossfade_time=0.05,
+        lookahead_time=0.05,
+        context_time=2.5,
+        hop_length=128,
+        sid=0,
+    ):
+        if f0_method == "harvest":
+            raise ValueError("harvest is too slow for streaming conversion")
+
+        engine.get_vc(pth_file)
+        self.hubert_model = engine.load_hubert()
+        self.net_g = engine.net_g
+        self.vc = engine.vc
+        self.tgt_sr = engine.tgt_sr
+        self.if_f0 = engine.if_f0
+        self.version = engine.version
+        self.device = engine.config.device
+
+        self.f0_up_key = int(f0_up_key)
+        self.f0_method = f0_method
+        self.index_rate = float(index_rate)
+        self.protect = protect
+        self.hop_length = hop_length
+        self.sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+
+        self.block_frames = max(1, round(block_time * 100))
+        self.crossfade_frames = round(crossfade_time * 100)
+        self.lookahead_frames = round(lookahead_time * 100)
+        self.context_frames = round(context_time * 100)
+        if self.crossfade_frames > self.block_frames:
+            raise ValueError("crossfade_time must not be longer than block_time")
+        self.tail_frames = (
+            self.crossfade_frames + self.block_frames + self.lookahead_frames
+        )
+
+        file_index = index_path.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
+        file_index = file_index.replace("trained", "added")
+        if file_index != "" and os.path.exists(file_index) and self.index_rate != 0:
+            self.index, self.big_npy = self.vc.load_index(file_index)
+        else:
+            self.index = self.big_npy = None
+
+        self.block_size = self.block_frames * self.window
+        self.input_wav = np.zeros(
+            (self.context_frames + self.tail_frames) * self.window, dtype=np.float32
+        )
+        self.pending = np.zeros(0, dtype=np.float32)
+
+        self.hop_tgt = self.tgt_sr // 100
+        self.crossfade_size = self.crossfade_frames * self.hop_tgt
+        fade = np.sin(0.5 * np.pi * np.linspace(0.0, 1.0, self.crossfade_size)) ** 2
+        self.fade_in, self.fade_out = fade, 1 - fade
+        self.prev_tail = np.zeros(self.crossfade_size, dtype=np.float32)
+
+        self.latencies = []
+
+    @property
+    def algorithmic_latency(self):
+        """Delay in seconds added by buffering, crossfade and lookahead."""
+        return self.tail_frames / 100
+
+    def convert_block(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        self.input_wav = np.concatenate([self.input_wav[block.shape[0] :], block])
+
+        t0 = ttime()
+        audio = signal.filtfilt(bh, ah, self.input_wav)
+        p_len = audio.shape[0] // self.window
+        pitch = pitchf = None
+        if self.if_f0 == 1:
+            pitch, pitchf = self.vc.get_f0(
+                None,
+                audio,
+                p_len,
+                self.f0_up_key,
+                self.f0_method,
+                3,
+                self.hop_length,
+                use_cache=False,
+            )
+            pitch = torch.tensor(pitch[:p_len], device=self.device).unsqueeze(0).long()
+            pitchf = (
+                torch.tensor(pitchf[:p_len], device=self.device).unsqueeze(0).float()
+            )
+        rate = torch.tensor([(self.tail_frames + 2) / p_len])
+        audio1 = self.vc.vc(
+            self.hubert_model,
+            self.net_g,
+            self.sid,
+            audio,
+            pitch,
+            pitchf,
+            self.index,
+            self.big_npy,
+            self.index_rate,
+            self.version,
+            self.protect,
+            rate,
+            use_cache=False,
+        )
+        # Drop the lookahead, it is rendered again with the next block
+        audio1 = audio1[-self.tail_frames * self.hop_tgt :]
+        audio1 = audio1[: (self.crossfade_frames + self.block_frames) * self.hop_tgt]
+
+        output = audio1[: self.block_frames * self.hop_tgt].copy()
+        output[: self.crossfade_size] = (
+            output[: self.crossfade_size] * self.fade_in
+            + self.prev_tail * self.fade_out
+        )
+        self.prev_tail = audio1[self.block_frames * self.hop_tgt :].copy()
+
+        compute_latency = ttime() - t0
+        self.latencies.append(
+            {
+                "algorithmic_latency": self.algorithmic_latency,
+                "compute_latency": compute_latency,
+            }
+        )
+        return output
+
+    def push(self, pcm):
+        """
+        Feed any number of samples; returns the converted audio for every
+        complete block available so far (possibly empty).
+        """
+        self.pending = np.concatenate([self.pending, np.asarray(pcm, np.float32)])
+        outputs = []
+        while self.pending.shape[0] >= self.block_size:
+            outputs.append(self.convert_block(self.pending[: self.block_size]))
+            self.pending = self.pending[self.block_size :]
+        if not outputs:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(outputs)
+
+    def stats(self):
+        compute = [latency["compute_latency"] for latency in self.latencies]
+        return {
+            "blocks": len(compute),
+            "block_time": self.block_frames / 100,
+            "algorithmic_latency": self.algorithmic_latency,
+            "compute_latency_mean": float(np.mean(compute)) if compute else 0.0,
+            "compute_latency_max": float(np.max(compute)) if compute else 0.0,
+        }
+
+
+def boundary_discontinuity(audio, block_size):
+    """
+    Ratio between the largest sample step across block boundaries and the
+    largest step inside blocks. Values well above 1 mean audible clicks.
+    """
+    steps = np.abs(np.diff(audio))
+    if steps.shape[0] == 0:
+        return 0.0
+    boundaries = np.arange(block_size, audio.shape[0], block_size) - 1
+    inner = np.delete(steps, boundaries)
+    return float(steps[boundaries].max(initial=0) / max(inner.max(initial=0), 1e-9))
+
+
+def stream_file(
+    converter, input_path, output_path, block_size=None, tolerance=max_discontinuity
+):
+    """
+    Feed a file through a StreamingConverter in fixed size blocks, as an
+    audio callback would, and write the time-aligned output. Raises once
+    the output is written when the boundary discontinuity is above
+    tolerance; None skips the check.
+    """
+    block_size = block_size or converter.block_size
+    audio = load_audio(input_path, 16000)
+
+    outputs = []
+    for start in range(0, audio.shape[0], block_size):
+        outputs.append(converter.push(audio[start : start + block_size]))
+
+    # Flush the audio still held back by the crossfade and lookahead
+    delay = (converter.crossfade_frames + converter.lookahead_frames) * converter.window
+    outputs.append(converter.push(np.zeros(delay + converter.block_size, np.float32)))
+
+    audio_opt = np.concatenate(outputs)
+    delay_tgt = (
+        converter.crossfade_frames + converter.lookahead_frames
+    ) * converter.hop_tgt
+    length_tgt = audio.shape[0] * converter.tgt_sr // 16000
+    audio_opt = audio_opt[delay_tgt : delay_tgt + length_tgt]
+    sf.write(output_path, audio_opt, converter.tgt_sr, format="WAV")
+
+    stats = converter.stats()
+    block_size_tgt = converter.block_frames * converter.hop_tgt
+    stats["discontinuity"] = boundary_discontinuity(
+        audio_opt[-delay_tgt % block_size_tgt :], block_size_tgt
+    )
+    if tolerance is not None and stats["discontinuity"] > tolerance:
+        raise RuntimeError(
+            f"Boundary discontinuity {stats['discontinuity']:.2f} is above "
+            f"{tolerance}, the output has clicks at block boundaries"
+        )
+    return stats
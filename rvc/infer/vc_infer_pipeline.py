@@ -6,28 +6,230 @@ from torch import Tensor
 import scipy.signal as signal
 import pyworld, os, faiss, librosa, torchcrepe
 from scipy import signal
-from functools import lru_cache
+import hashlib
+from collections import OrderedDict
+import multiprocessing
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 
+from rvc.lib.metrics import metrics
+
 bh, ah = signal.butter(N=5, Wn=48, btype="high", fs=16000)
 
-input_audio_path2wav = {}
 
+class F0Cache:
+    """
+    Bounded LRU cache of extracted F0 curves, keyed by a hash of the audio
+    content, the F0 method and its parameters. The curve is stored before
+    the pitch shift and the optional F0 file are applied, so re-running a
+    source with other pitch or index settings skips extraction. When
+    cache_dir is set, curves are also kept there as .npy files.
+    """
+
+    def __init__(self, max_entries=256, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(x, *params):
+        digest = hashlib.sha1(np.ascontiguousarray(x).view(np.uint8))
+        digest.update(repr(params).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        f0 = self.entries.get(key)
+        if f0 is None and self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, f"{key}.npy")
+            if os.path.exists(path):
+                f0 = np.load(path)
+                self.entries[key] = f0
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        if f0 is None:
+            self.misses += 1
+            metrics.increment("cache_misses", cache="f0")
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        metrics.increment("cache_hits", cache="f0")
+        return f0
+
+    def put(self, key, f0):
+        self.entries[key] = f0
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.save(os.path.join(self.cache_dir, f"{key}.npy"), f0)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class FeatureCache:
+    """
+    Opt-in on-disk cache of HuBERT features, stored as float16 .npy files
+    named after a hash of the padded 16 kHz segment and the output layer.
+    Disabled while cache_dir is None. A hit touches its file, so when the
+    directory grows past max_bytes the least recently used files are
+    removed first.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=2 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size_bytes = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(audio, version, is_half):
+        digest = hashlib.sha1(np.ascontiguousarray(audio).view(np.uint8))
+        digest.update(f"{9 if version == 'v1' else 12}-{version}-{is_half}".encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.cache_dir, f"{key}.npy")
+        if not os.path.exists(path):
+            self.misses += 1
+            metrics.increment("cache_misses", cache="feature")
+            return None
+        self.hits += 1
+        metrics.increment("cache_hits", cache="feature")
+        feats = np.load(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return feats
+
+    def put(self, key, feats):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, f"{key}.npy")
+        np.save(path, feats.astype(np.float16))
+        if self.size_bytes is None:
+            # First write: measures the directory, shrinking it if needed
+            self.shrink()
+        else:
+            self.size_bytes += os.path.getsize(path)
+            if self.size_bytes > self.max_bytes:
+                self.shrink()
+
+    def shrink(self):
+        # Batch workers can share the directory and remove files meanwhile
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.size_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size_bytes <= self.max_bytes * 0.9:
+                break
+            self.size_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
 
-@lru_cache
-def cache_harvest_f0(input_audio_path, fs, f0max, f0min, frame_period):
-    audio = input_audio_path2wav[input_audio_path]
-    f0, t = pyworld.harvest(
-        audio,
-        fs=fs,
-        f0_ceil=f0max,
-        f0_floor=f0min,
-        frame_period=frame_period,
-    )
-    f0 = pyworld.stonemask(audio, f0, t, fs)
-    return f0
+
+class IndexCache:
+    """
+    Keeps faiss indexes and their feature matrix (big_npy) loaded across
+    pipeline calls, keyed by index path, size and mtime. Every VC owns one,
+    so an index is released with the voice model that uses it and counted
+    in its size_bytes. big_npy is
+    memory-mapped, so only the rows gathered after a search are paged in,
+    from the .npy sidecar extract_index.py writes next to the index or
+    else from its total_fea.npy. Older indexes without either fall back to
+    reconstruct_n.
+    """
+
+    def __init__(self, max_indexes=1):
+        self.max_indexes = max_indexes
+        self.indexes = OrderedDict()
+
+    def load(self, file_index):
+        stat = os.stat(file_index)
+        key = (os.path.abspath(file_index), stat.st_size, stat.st_mtime)
+        if key in self.indexes:
+            self.indexes.move_to_end(key)
+            metrics.increment("cache_hits", cache="index")
+            return self.indexes[key]
+
+        metrics.increment("cache_misses", cache="index")
+        with metrics.timer("index_load"):
+            index = faiss.read_index(file_index)
+            big_npy = self.load_features(file_index, index, stat.st_mtime)
+        for cached_key in list(self.indexes):
+            if cached_key[0] == key[0]:
+                del self.indexes[cached_key]
+        self.indexes[key] = index, big_npy
+        while len(self.indexes) > self.max_indexes:
+            self.indexes.popitem(last=False)
+        return index, big_npy
+
+    @staticmethod
+    def load_features(file_index, index, index_mtime):
+        # The sidecar is written right after the index, total_fea.npy right
+        # before it; either one only matches the index of the same run
+        sidecar = os.path.splitext(file_index)[0] + ".npy"
+        total_fea = os.path.join(os.path.dirname(file_index), "total_fea.npy")
+        candidates = []
+        if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= index_mtime:
+            candidates.append(sidecar)
+        if os.path.exists(total_fea) and os.path.getmtime(total_fea) <= index_mtime:
+            candidates.append(total_fea)
+        for features in candidates:
+            big_npy = np.load(features, mmap_mode="r")
+            if big_npy.dtype in (np.float16, np.float32) and big_npy.shape == (
+                index.ntotal,
+                index.d,
+            ):
+                return big_npy
+        return index.reconstruct_n(0, index.ntotal)
+
+
+def compute_f0_piece(args):
+    x, f0_method, fs, f0_max, f0_min, frame_period = args
+    if f0_method == "harvest":
+        f0, t = pyworld.harvest(
+            x, fs=fs, f0_ceil=f0_max, f0_floor=f0_min, frame_period=frame_period
+        )
+    else:
+        f0, t = pyworld.dio(
+            x, fs=fs, f0_ceil=f0_max, f0_floor=f0_min, frame_period=frame_period
+        )
+    return pyworld.stonemask(x, f0, t, fs)
+
+
+f0_pool = None
+f0_pool_processes = 0
+
+
+def get_f0_pool(processes):
+    global f0_pool, f0_pool_processes
+    if f0_pool is None or f0_pool_processes != processes:
+        if f0_pool is not None:
+            f0_pool.terminate()
+        f0_pool = multiprocessing.Pool(processes)
+        f0_pool_processes = processes
+    return f0_pool
 
 
 def change_rms(data1, sr1, data2, sr2, rate):
@@ -67,6 +269,27 @@ class VC(object):
         self.t_center = self.sr * self.x_center
         self.t_max = self.sr * self.x_max
         self.device = config.device
+        # mel frames (10 ms each) per RMVPE forward pass, bounds its memory
+        # on long inputs
+        self.rmvpe_chunk_size = 32000
+        # samples a segment can be zero padded by in a vc_batch batch, 4
+        # HuBERT frames
+        self.max_batch_padding = 4 * 320
+        self.index = None
+        self.big_npy = None
+        self.index_cache = IndexCache()
+        # Replaced by the caches of the engine that loads this voice, so
+        # they are shared across voices
+        self.f0_cache = F0Cache()
+        self.feature_cache = FeatureCache()
+
+    def load_index(self, file_index):
+        try:
+            self.index, self.big_npy = self.index_cache.load(file_index)
+        except Exception as error:
+            print(error)
+            self.index = self.big_npy = None
+        return self.index, self.big_npy
 
     def get_optimal_torch_device(self, index: int = 0) -> torch.device:
         if torch.cuda.is_available():
@@ -141,23 +364,74 @@ class VC(object):
         f0 = f0[0].cpu().numpy()
         return f0
 
-    def get_f0(
-        self,
-        input_audio_path,
-        x,
-        p_len,
-        f0_up_key,
-        f0_method,
-        filter_radius,
-        hop_length,
-        inp_f0=None,
-    ):
-        global input_audio_path2wav
+    def find_split_points(self, audio, interval):
+        # Quietest point within t_query of every multiple of interval
+        audio_pad = np.pad(audio, (self.window // 2, self.window // 2), mode="reflect")
+        audio_sum = np.zeros_like(audio)
+        for i in range(self.window):
+            audio_sum += audio_pad[i : i - self.window]
+        opt_ts = []
+        for t in range(interval, audio.shape[0], interval):
+            opt_ts.append(
+                t
+                - self.t_query
+                + np.where(
+                    np.abs(audio_sum[t - self.t_query : t + self.t_query])
+                    == np.abs(audio_sum[t - self.t_query : t + self.t_query]).min()
+                )[0][0]
+            )
+        return opt_ts
+
+    def preprocess(self, audio):
+        # Model independent front end: high-pass filter and split points
+        with metrics.timer("highpass"):
+            audio = signal.filtfilt(bh, ah, audio)
+        opt_ts = []
+        if audio.shape[0] + self.window > self.t_max:
+            opt_ts = self.find_split_points(audio, self.t_center)
+        return audio, opt_ts
+
+    def get_f0_parallel(self, x, f0_method, f0_min, f0_max, processes):
+        """
+        harvest/dio F0 computed in a process pool. The audio is cut at quiet
+        points into one piece per process, each piece gets one second of
+        context on both sides and its own frames are stitched back, so the
+        frame grid is the one of a single pass over x.
+        """
+        x = x.astype(np.double)
+        margin = self.sr
+        interval = max(x.shape[0] // processes, self.t_query * 2)
+        bounds = [
+            t // self.window * self.window for t in self.find_split_points(x, interval)
+        ]
+        bounds = [0] + bounds + [x.shape[0]]
+        pieces = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            context_start = max(start - margin, 0)
+            pieces.append(
+                (
+                    x[context_start : min(end + margin, x.shape[0])],
+                    f0_method,
+                    self.sr,
+                    f0_max,
+                    f0_min,
+                    10,
+                )
+            )
+        f0_pieces = get_f0_pool(processes).map(compute_f0_piece, pieces)
+        f0 = []
+        for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            offset = (start - max(start - margin, 0)) // self.window
+            if i == len(pieces) - 1:
+                f0.append(f0_pieces[i][offset:])
+            else:
+                f0.append(f0_pieces[i][offset : offset + (end - start) // self.window])
+        return np.concatenate(f0)
+
+    def compute_f0(self, x, p_len, f0_method, filter_radius, hop_length, f0_processes):
         time_step = self.window / self.sr * 1000
         f0_min = 50
         f0_max = 1100
-        f0_mel_min = 1127 * np.log(1 + f0_min / 700)
-        f0_mel_max = 1127 * np.log(1 + f0_max / 700)
         if f0_method == "pm":
             f0 = (
                 parselmouth.Sound(x, self.sr)
@@ -175,19 +449,32 @@ class VC(object):
                     f0, [[pad_size, p_len - len(f0) - pad_size]], mode="constant"
                 )
         elif f0_method == "harvest":
-            input_audio_path2wav[input_audio_path] = x.astype(np.double)
-            f0 = cache_harvest_f0(input_audio_path, self.sr, f0_max, f0_min, 10)
+            if f0_processes > 1:
+                f0 = self.get_f0_parallel(x, f0_method, f0_min, f0_max, f0_processes)
+            else:
+                audio = x.astype(np.double)
+                f0, t = pyworld.harvest(
+                    audio,
+                    fs=self.sr,
+                    f0_ceil=f0_max,
+                    f0_floor=f0_min,
+                    frame_period=10,
+                )
+                f0 = pyworld.stonemask(audio, f0, t, self.sr)
             if int(filter_radius) > 2:
                 f0 = signal.medfilt(f0, 3)
         elif f0_method == "dio":
-            f0, t = pyworld.dio(
-                x.astype(np.double),
-                fs=self.sr,
-                f0_ceil=f0_max,
-                f0_floor=f0_min,
-                frame_period=10,
-            )
-            f0 = pyworld.stonemask(x.astype(np.double), f0, t, self.sr)
+            if f0_processes > 1:
+                f0 = self.get_f0_parallel(x, f0_method, f0_min, f0_max, f0_processes)
+            else:
+                f0, t = pyworld.dio(
+                    x.astype(np.double),
+                    fs=self.sr,
+                    f0_ceil=f0_max,
+                    f0_floor=f0_min,
+                    frame_period=10,
+                )
+                f0 = pyworld.stonemask(x.astype(np.double), f0, t, self.sr)
             f0 = signal.medfilt(f0, 3)
         elif f0_method == "crepe":
             f0 = self.get_f0_crepe_computation(
@@ -202,11 +489,59 @@ class VC(object):
                 from rvc.lib.rmvpe import RMVPE
 
                 self.model_rmvpe = RMVPE(
-                    "rmvpe.pt", is_half=self.is_half, device=self.device
+                    "rmvpe.pt",
+                    is_half=self.is_half,
+                    device=self.device,
+                    chunk_size=self.rmvpe_chunk_size,
                 )
             f0 = self.model_rmvpe.infer_from_audio(x, thred=0.03)
+        return f0
 
-        f0 *= pow(2, f0_up_key / 12)
+    def get_f0(
+        self,
+        input_audio_path,
+        x,
+        p_len,
+        f0_up_key,
+        f0_method,
+        filter_radius,
+        hop_length,
+        inp_f0=None,
+        f0_processes=1,
+        use_cache=True,
+    ):
+        f0_min = 50
+        f0_max = 1100
+        f0_mel_min = 1127 * np.log(1 + f0_min / 700)
+        f0_mel_max = 1127 * np.log(1 + f0_max / 700)
+        params = (
+            f0_method,
+            p_len,
+            int(filter_radius) > 2,
+            str(hop_length),
+            f0_processes,
+            self.is_half,
+        )
+        if f0_method == "rmvpe":
+            # A shared RMVPE model may have been built with another chunk size
+            model_rmvpe = getattr(self, "model_rmvpe", None)
+            if model_rmvpe is None:
+                params += (self.rmvpe_chunk_size,)
+            else:
+                params += (model_rmvpe.chunk_size,)
+        f0 = None
+        if use_cache:
+            key = self.f0_cache.key(x, *params)
+            f0 = self.f0_cache.get(key)
+        if f0 is None:
+            with metrics.timer("f0", method=f0_method):
+                f0 = self.compute_f0(
+                    x, p_len, f0_method, filter_radius, hop_length, f0_processes
+                )
+            if use_cache:
+                self.f0_cache.put(key, f0)
+
+        f0 = f0 * pow(2, f0_up_key / 12)
         tf0 = self.sr // self.window
         if inp_f0 is not None:
             delta_t = np.round(
@@ -230,6 +565,95 @@ class VC(object):
 
         return f0_coarse, f0bak
 
+    @staticmethod
+    def hubert_frames(length):
+        # HuBERT's convolutions have a 400 sample window and a 320 sample hop
+        return (length - 400) // 320 + 1
+
+    def extract_features(self, model, audios, version):
+        # HuBERT's first convolution is followed by a GroupNorm over time,
+        # so zero padding would change the features of a shorter segment:
+        # segments only share a forward pass with segments of equal length
+        # and the results are zero padded afterwards
+        lengths = [audio0.shape[0] for audio0 in audios]
+        groups = {}
+        for i, length in enumerate(lengths):
+            groups.setdefault(length, []).append(i)
+        n_frames = [self.hubert_frames(length) for length in lengths]
+        feats = None
+        t0 = ttime()
+        for length, members in groups.items():
+            source = torch.from_numpy(np.stack([audios[i] for i in members]))
+            source = source.half() if self.is_half else source.float()
+            inputs = {
+                "source": source.to(self.device),
+                "padding_mask": torch.zeros(source.shape, dtype=torch.bool).to(
+                    self.device
+                ),
+                "output_layer": 9 if version == "v1" else 12,
+            }
+            with torch.no_grad():
+                logits = model.extract_features(**inputs)
+                group_feats = (
+                    model.final_proj(logits[0]) if version == "v1" else logits[0]
+                )
+            if feats is None:
+                feats = torch.zeros(
+                    (len(audios), max(n_frames), group_feats.shape[2]),
+                    dtype=group_feats.dtype,
+                    device=group_feats.device,
+                )
+            n = min(group_feats.shape[1], feats.shape[1])
+            for j, i in enumerate(members):
+                feats[i, :n] = group_feats[j, :n]
+                n_frames[i] = n
+        if str(self.device).startswith("cuda"):
+            # Kernels run asynchronously, wait for them so the time is HuBERT's
+            torch.cuda.synchronize()
+        metrics.observe("hubert", ttime() - t0)
+        return feats, n_frames
+
+    def get_features(self, model, audios, version, use_cache=True, memo=None):
+        # HuBERT features only depend on the 16 kHz audio and the output
+        # layer, so they are reused when every segment of the batch is found
+        # in memo (shared by the voices of one fan-out) or the disk cache
+        feature_cache = self.feature_cache
+        use_disk = feature_cache.cache_dir is not None and use_cache
+        if not use_disk and memo is None:
+            return self.extract_features(model, audios, version)
+
+        keys = [feature_cache.key(audio0, version, self.is_half) for audio0 in audios]
+        cached = []
+        for key in keys:
+            feats = memo.get(key) if memo is not None else None
+            if feats is None and use_disk:
+                npy = feature_cache.get(key)
+                feats = None if npy is None else torch.from_numpy(npy)
+            cached.append(feats)
+        if any(feats is None for feats in cached):
+            feats, n_frames = self.extract_features(model, audios, version)
+            for i, key in enumerate(keys):
+                if memo is not None:
+                    memo[key] = feats[i, : n_frames[i]]
+                if use_disk and cached[i] is None:
+                    feature_cache.put(key, feats[i, : n_frames[i]].cpu().numpy())
+            return feats, n_frames
+
+        cached = [
+            cached_feats[: self.hubert_frames(audio0.shape[0])]
+            for cached_feats, audio0 in zip(cached, audios)
+        ]
+        n_frames = [cached_feats.shape[0] for cached_feats in cached]
+        dtype = torch.float16 if self.is_half else torch.float32
+        feats = torch.zeros(
+            (len(audios), max(n_frames), cached[0].shape[1]),
+            dtype=dtype,
+            device=self.device,
+        )
+        for i, cached_feats in enumerate(cached):
+            feats[i, : n_frames[i]] = cached_feats.to(self.device, dtype)
+        return feats, n_frames
+
     def vc(
         self,
         model,
@@ -243,88 +667,135 @@ class VC(object):
         index_rate,
         version,
         protect,
+        rate=None,
+        use_cache=True,
     ):
-        feats = torch.from_numpy(audio0)
-        if self.is_half:
-            feats = feats.half()
-        else:
-            feats = feats.float()
-        if feats.dim() == 2:
-            feats = feats.mean(-1)
-        assert feats.dim() == 1, feats.dim()
-        feats = feats.view(1, -1)
-        padding_mask = torch.BoolTensor(feats.shape).to(self.device).fill_(False)
-
-        inputs = {
-            "source": feats.to(self.device),
-            "padding_mask": padding_mask,
-            "output_layer": 9 if version == "v1" else 12,
-        }
-        t0 = ttime()
-        with torch.no_grad():
-            logits = model.extract_features(**inputs)
-            feats = model.final_proj(logits[0]) if version == "v1" else logits[0]
-        if protect < 0.5 and pitch != None and pitchf != None:
+        return self.vc_batch(
+            model,
+            net_g,
+            sid,
+            [(audio0, pitch, pitchf)],
+            index,
+            big_npy,
+            index_rate,
+            version,
+            protect,
+            rate,
+            use_cache,
+        )[0]
+
+    def vc_batch(
+        self,
+        model,
+        net_g,
+        sid,
+        segments,
+        index,
+        big_npy,
+        index_rate,
+        version,
+        protect,
+        rate=None,
+        use_cache=True,
+        feature_memo=None,
+    ):
+        # segments is a list of (audio0, pitch, pitchf) tuples, they are
+        # zero padded to a common length and converted in a single batch
+        with_pitch = segments[0][1] is not None and segments[0][2] is not None
+        audios = [
+            audio0.mean(-1) if audio0.ndim == 2 else audio0 for audio0, _, _ in segments
+        ]
+        lengths = [audio0.shape[0] for audio0 in audios]
+        feats, n_frames = self.get_features(
+            model, audios, version, use_cache, feature_memo
+        )
+        if protect < 0.5 and with_pitch:
             feats0 = feats.clone()
         if (
             isinstance(index, type(None)) == False
             and isinstance(big_npy, type(None)) == False
             and index_rate != 0
         ):
-            npy = feats[0].cpu().numpy()
+            t_index = ttime()
+            npy = (
+                torch.cat([feats[i, :n] for i, n in enumerate(n_frames)], dim=0)
+                .cpu()
+                .numpy()
+            )
             if self.is_half:
                 npy = npy.astype("float32")
 
             score, ix = index.search(npy, k=8)
             weight = np.square(1 / score)
             weight /= weight.sum(axis=1, keepdims=True)
-            npy = np.sum(big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
+            npy = np.sum(
+                big_npy[ix].astype("float32") * np.expand_dims(weight, axis=2), axis=1
+            )
+            metrics.observe("index_search", ttime() - t_index)
 
             if self.is_half:
                 npy = npy.astype("float16")
-            feats = (
-                torch.from_numpy(npy).unsqueeze(0).to(self.device) * index_rate
-                + (1 - index_rate) * feats
-            )
+            retrieved = torch.zeros_like(feats)
+            offset = 0
+            for i, n in enumerate(n_frames):
+                retrieved[i, :n] = torch.from_numpy(npy[offset : offset + n])
+                offset += n
+            feats = retrieved * index_rate + (1 - index_rate) * feats
 
         feats = F.interpolate(feats.permute(0, 2, 1), scale_factor=2).permute(0, 2, 1)
-        if protect < 0.5 and pitch != None and pitchf != None:
+        if protect < 0.5 and with_pitch:
             feats0 = F.interpolate(feats0.permute(0, 2, 1), scale_factor=2).permute(
                 0, 2, 1
             )
-        t1 = ttime()
-        p_len = audio0.shape[0] // self.window
-        if feats.shape[1] < p_len:
-            p_len = feats.shape[1]
-            if pitch != None and pitchf != None:
-                pitch = pitch[:, :p_len]
-                pitchf = pitchf[:, :p_len]
-
-        if protect < 0.5 and pitch != None and pitchf != None:
+        # From each segment's own length, as if it was converted alone
+        p_lens = [
+            min(length // self.window, self.hubert_frames(length) * 2)
+            for length in lengths
+        ]
+        if with_pitch:
+            pitch = torch.zeros(
+                (len(segments), feats.shape[1]), dtype=torch.long, device=self.device
+            )
+            pitchf = torch.zeros(
+                (len(segments), feats.shape[1]),
+                dtype=segments[0][2].dtype,
+                device=self.device,
+            )
+            for i, (_, seg_pitch, seg_pitchf) in enumerate(segments):
+                n = min(p_lens[i], seg_pitch.shape[1])
+                pitch[i, :n] = seg_pitch[0, :n]
+                pitchf[i, :n] = seg_pitchf[0, :n]
+            if len(segments) == 1 and p_lens[0] < feats.shape[1]:
+                pitch = pitch[:, : p_lens[0]]
+                pitchf = pitchf[:, : p_lens[0]]
+
+        if protect < 0.5 and with_pitch:
             pitchff = pitchf.clone()
             pitchff[pitchf > 0] = 1
             pitchff[pitchf < 1] = protect
             pitchff = pitchff.unsqueeze(-1)
             feats = feats * pitchff + feats0 * (1 - pitchff)
             feats = feats.to(feats0.dtype)
-        p_len = torch.tensor([p_len], device=self.device).long()
+        p_len = torch.tensor(p_lens, device=self.device).long()
+        sid = sid.expand(len(segments))
+        t_synthesis = ttime()
         with torch.no_grad():
-            if pitch != None and pitchf != None:
-                audio1 = (
-                    (net_g.infer(feats, p_len, pitch, pitchf, sid)[0][0, 0])
-                    .data.cpu()
-                    .float()
-                    .numpy()
-                )
+            if with_pitch:
+                audio1 = net_g.infer(feats, p_len, pitch, pitchf, sid, rate)[0][:, 0]
             else:
-                audio1 = (
-                    (net_g.infer(feats, p_len, sid)[0][0, 0]).data.cpu().float().numpy()
-                )
-        del feats, p_len, padding_mask
+                audio1 = net_g.infer(feats, p_len, sid, rate)[0][:, 0]
+            audio1 = audio1.data.cpu().float().numpy()
+        metrics.observe("synthesis", ttime() - t_synthesis)
+        metrics.increment("segments", len(segments))
+        if len(segments) == 1:
+            audio_opt = [audio1[0]]
+        else:
+            hop = audio1.shape[-1] // feats.shape[1]
+            audio_opt = [audio1[i, : p_lens[i] * hop] for i in range(len(segments))]
+        del feats, p_len
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-        t2 = ttime()
-        return audio1
+        return audio_opt
 
     def pipeline(
         self,
@@ -346,36 +817,151 @@ class VC(object):
         protect,
         hop_length,
         f0_file=None,
+        batch_size=1,
+        f0_processes=1,
+        front=None,
+        feature_memo=None,
     ):
         if file_index != "" and os.path.exists(file_index) == True and index_rate != 0:
-            try:
-                index = faiss.read_index(file_index)
-                big_npy = index.reconstruct_n(0, index.ntotal)
-            except Exception as error:
-                print(error)
-                index = big_npy = None
+            index, big_npy = self.load_index(file_index)
         else:
             index = big_npy = None
-        audio = signal.filtfilt(bh, ah, audio)
-        audio_pad = np.pad(audio, (self.window // 2, self.window // 2), mode="reflect")
-        opt_ts = []
-        if audio_pad.shape[0] > self.t_max:
-            audio_sum = np.zeros_like(audio)
-            for i in range(self.window):
-                audio_sum += audio_pad[i : i - self.window]
-            for t in range(self.t_center, audio.shape[0], self.t_center):
-                opt_ts.append(
-                    t
-                    - self.t_query
-                    + np.where(
-                        np.abs(audio_sum[t - self.t_query : t + self.t_query])
-                        == np.abs(audio_sum[t - self.t_query : t + self.t_query]).min()
-                    )[0][0]
+        audio, segments = self.pipeline_segments(
+            audio,
+            input_audio_path,
+            f0_up_key,
+            f0_method,
+            if_f0,
+            filter_radius,
+            hop_length,
+            f0_file,
+            f0_processes,
+            front,
+        )
+        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+        audio_opt = []
+        for i in range(0, len(segments), batch_size):
+            audio_opt.extend(
+                self.vc_batch(
+                    model,
+                    net_g,
+                    sid,
+                    segments[i : i + batch_size],
+                    index,
+                    big_npy,
+                    index_rate,
+                    version,
+                    protect,
+                    feature_memo=feature_memo,
                 )
+            )
+        return self.pipeline_output(audio, audio_opt, tgt_sr, resample_sr, rms_mix_rate)
+
+    def length_batches(self, items, batch_size):
+        # Regions of one input can have very different lengths. Items, whose
+        # last element is a segment, are sorted by length and a batch only
+        # takes segments at most max_batch_padding samples longer than its
+        # shortest, so equal lengths share HuBERT passes and the synthesizer
+        # pads a few frames at most
+        items = sorted(items, key=lambda item: item[-1][0].shape[0])
+        batch = []
+        for item in items:
+            if batch and (
+                len(batch) >= batch_size
+                or item[-1][0].shape[0] - batch[0][-1][0].shape[0]
+                > self.max_batch_padding
+            ):
+                yield batch
+                batch = []
+            batch.append(item)
+        if batch:
+            yield batch
+
+    def pipeline_chunks(
+        self,
+        model,
+        net_g,
+        sid,
+        chunks,
+        f0_up_key,
+        f0_method,
+        file_index,
+        index_rate,
+        if_f0,
+        filter_radius,
+        tgt_sr,
+        resample_sr,
+        rms_mix_rate,
+        version,
+        protect,
+        hop_length,
+        batch_size=1,
+        f0_processes=1,
+    ):
+        # Converts independent chunks of one input, their segments share
+        # the vc_batch batches; returns the converted audio of every chunk
+        if file_index != "" and os.path.exists(file_index) == True and index_rate != 0:
+            index, big_npy = self.load_index(file_index)
+        else:
+            index = big_npy = None
+        prepared = [
+            self.pipeline_segments(
+                chunk,
+                None,
+                f0_up_key,
+                f0_method,
+                if_f0,
+                filter_radius,
+                hop_length,
+                f0_processes=f0_processes,
+            )
+            for chunk in chunks
+        ]
+        flat = [
+            (i, j, segment)
+            for i, (_, segments) in enumerate(prepared)
+            for j, segment in enumerate(segments)
+        ]
+        outputs = [[None] * len(segments) for _, segments in prepared]
+        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+        for batch in self.length_batches(flat, batch_size):
+            results = self.vc_batch(
+                model,
+                net_g,
+                sid,
+                [segment for _, _, segment in batch],
+                index,
+                big_npy,
+                index_rate,
+                version,
+                protect,
+            )
+            for (i, j, _), audio1 in zip(batch, results):
+                outputs[i][j] = audio1
+        return [
+            self.pipeline_output(audio, outputs[i], tgt_sr, resample_sr, rms_mix_rate)
+            for i, (audio, _) in enumerate(prepared)
+        ]
+
+    def pipeline_segments(
+        self,
+        audio,
+        input_audio_path,
+        f0_up_key,
+        f0_method,
+        if_f0,
+        filter_radius,
+        hop_length,
+        f0_file=None,
+        f0_processes=1,
+        front=None,
+    ):
+        # Everything before the models: high-pass, split points and F0.
+        # Returns the filtered audio and the (audio, pitch, pitchf) segments
+        # vc_batch converts
+        audio, opt_ts = front if front is not None else self.preprocess(audio)
         s = 0
-        audio_opt = []
         t = None
-        t1 = ttime()
         audio_pad = np.pad(audio, (self.t_pad, self.t_pad), mode="reflect")
         p_len = audio_pad.shape[0] // self.window
         inp_f0 = None
@@ -389,7 +975,6 @@ class VC(object):
                 inp_f0 = np.array(inp_f0, dtype="float32")
             except Exception as error:
                 print(error)
-        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
         pitch, pitchf = None, None
         if if_f0 == 1:
             pitch, pitchf = self.get_f0(
@@ -401,6 +986,7 @@ class VC(object):
                 filter_radius,
                 hop_length,
                 inp_f0,
+                f0_processes,
             )
             pitch = pitch[:p_len]
             pitchf = pitchf[:p_len]
@@ -408,87 +994,53 @@ class VC(object):
                 pitchf = pitchf.astype(np.float32)
             pitch = torch.tensor(pitch, device=self.device).unsqueeze(0).long()
             pitchf = torch.tensor(pitchf, device=self.device).unsqueeze(0).float()
-        t2 = ttime()
+        segments = []
         for t in opt_ts:
             t = t // self.window * self.window
             if if_f0 == 1:
-                audio_opt.append(
-                    self.vc(
-                        model,
-                        net_g,
-                        sid,
+                segments.append(
+                    (
                         audio_pad[s : t + self.t_pad2 + self.window],
                         pitch[:, s // self.window : (t + self.t_pad2) // self.window],
                         pitchf[:, s // self.window : (t + self.t_pad2) // self.window],
-                        index,
-                        big_npy,
-                        index_rate,
-                        version,
-                        protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
+                    )
                 )
             else:
-                audio_opt.append(
-                    self.vc(
-                        model,
-                        net_g,
-                        sid,
-                        audio_pad[s : t + self.t_pad2 + self.window],
-                        None,
-                        None,
-                        index,
-                        big_npy,
-                        index_rate,
-                        version,
-                        protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
+                segments.append(
+                    (audio_pad[s : t + self.t_pad2 + self.window], None, None)
                 )
             s = t
         if if_f0 == 1:
-            audio_opt.append(
-                self.vc(
-                    model,
-                    net_g,
-                    sid,
+            segments.append(
+                (
                     audio_pad[t:],
                     pitch[:, t // self.window :] if t is not None else pitch,
                     pitchf[:, t // self.window :] if t is not None else pitchf,
-                    index,
-                    big_npy,
-                    index_rate,
-                    version,
-                    protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
+                )
             )
         else:
-            audio_opt.append(
-                self.vc(
-                    model,
-                    net_g,
-                    sid,
-                    audio_pad[t:],
-                    None,
-                    None,
-                    index,
-                    big_npy,
-                    index_rate,
-                    version,
-                    protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
-            )
-        audio_opt = np.concatenate(audio_opt)
+            segments.append((audio_pad[t:], None, None))
+        return audio, segments
+
+    def pipeline_output(self, audio, outputs, tgt_sr, resample_sr, rms_mix_rate):
+        # Joins the converted segments of pipeline_segments and applies the
+        # RMS mix, the resample and the int16 conversion
+        audio_opt = np.concatenate(
+            [audio1[self.t_pad_tgt : -self.t_pad_tgt] for audio1 in outputs]
+        )
         if rms_mix_rate != 1:
-            audio_opt = change_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
+            with metrics.timer("rms_mix"):
+                audio_opt = change_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
         if resample_sr >= 16000 and tgt_sr != resample_sr:
-            audio_opt = librosa.resample(
-                audio_opt, orig_sr=tgt_sr, target_sr=resample_sr
-            )
+            with metrics.timer("resample"):
+                audio_opt = librosa.resample(
+                    audio_opt, orig_sr=tgt_sr, target_sr=resample_sr
+                )
         audio_max = np.abs(audio_opt).max() / 0.99
         max_int16 = 32768
         if audio_max > 1:
             max_int16 /= audio_max
         audio_opt = (audio_opt * max_int16).astype(np.int16)
-        del pitch, pitchf, sid
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
         return audio_opt
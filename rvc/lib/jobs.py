@@ -0,0 +1,270 @@
+import os
+import signal
+import inspect
+import threading
+import multiprocessing
+import uuid
+from collections import OrderedDict, deque
+from time import time as ttime
+
+import numpy as np
+
+from rvc.lib.metrics import metrics
+
+
+def accepts_progress(function):
+    try:
+        return "progress" in inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def run_isolated(connection, function, kwargs, progress):
+    # Own process group, so cancelling also stops the scripts the job starts
+    if hasattr(os, "setsid"):
+        os.setsid()
+    connection.send(("ready", None))
+    if progress:
+        kwargs = dict(
+            kwargs, progress=lambda value: connection.send(("progress", value))
+        )
+    try:
+        connection.send(("done", function(**kwargs)))
+    except Exception as error:
+        connection.send(("error", (type(error).__name__, str(error))))
+    finally:
+        connection.close()
+
+
+class Job:
+    def __init__(self, function, kwargs, queue_name, isolate):
+        self.id = uuid.uuid4().hex
+        self.function = function
+        self.kwargs = kwargs
+        self.queue_name = queue_name
+        self.isolate = isolate
+        self.status = "queued"
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.error_type = None
+        self.submitted = ttime()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self.process = None
+        self.done = threading.Event()
+
+    def set_progress(self, value):
+        self.progress = float(value)
+
+    @property
+    def wait_time(self):
+        end = self.started or self.finished or ttime()
+        return end - self.submitted
+
+    @property
+    def run_time(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or ttime()) - self.started
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "queue": self.queue_name,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "wait_time": self.wait_time,
+            "run_time": self.run_time,
+        }
+
+
+class JobQueue:
+    """
+    Runs submitted functions in the background, at most limits[pool] at a
+    time for every (pool, device) pair. Jobs submitted with isolate=True
+    run in a child process so they can be cancelled while running; the
+    others run in a worker thread of this process, so they can use the warm
+    inference engine, and a cancel only takes effect once they return.
+    """
+
+    def __init__(self, limits, max_finished=1000, max_samples=1000):
+        self.limits = limits
+        self.max_finished = max_finished
+        self.max_samples = max_samples
+        self.jobs = OrderedDict()
+        self.queues = {}
+        self.running = {}
+        self.counters = {}
+        self.wait_times = {}
+        self.run_times = {}
+        self.condition = threading.Condition()
+        if hasattr(os, "fork"):
+            self.context = multiprocessing.get_context("fork")
+        else:
+            self.context = multiprocessing.get_context()
+
+    def submit(self, pool, device, function, kwargs, isolate=False):
+        queue_name = f"{pool}:{device}"
+        job = Job(function, kwargs, queue_name, isolate)
+        with self.condition:
+            if queue_name not in self.queues:
+                self.start_queue(queue_name, self.limits[pool])
+            self.jobs[job.id] = job
+            self.queues[queue_name].append(job)
+            self.condition.notify_all()
+        return job
+
+    def start_queue(self, queue_name, limit):
+        self.queues[queue_name] = deque()
+        self.running[queue_name] = 0
+        self.counters[queue_name] = {"done": 0, "failed": 0, "cancelled": 0}
+        self.wait_times[queue_name] = deque(maxlen=self.max_samples)
+        self.run_times[queue_name] = deque(maxlen=self.max_samples)
+        for _ in range(limit):
+            threading.Thread(
+                target=self.worker, args=(queue_name,), daemon=True
+            ).start()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def discard(self, job_id):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is not None and job.done.is_set():
+                del self.jobs[job_id]
+
+    def cancel(self, job_id):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == "queued":
+                self.queues[job.queue_name].remove(job)
+                self.finish(job, "cancelled")
+            elif job.status == "running":
+                job.cancel_requested = True
+                if job.isolate:
+                    self.kill(job)
+        return job
+
+    def worker(self, queue_name):
+        queue = self.queues[queue_name]
+        while True:
+            with self.condition:
+                while not queue:
+                    self.condition.wait()
+                job = queue.popleft()
+                job.status = "running"
+                job.started = ttime()
+                self.running[queue_name] += 1
+            try:
+                if job.isolate:
+                    self.run_process(job)
+                else:
+                    self.run_thread(job)
+            except Exception as error:
+                job.error_type, job.error = type(error).__name__, str(error)
+            with self.condition:
+                self.running[queue_name] -= 1
+                if job.cancel_requested:
+                    job.result = job.error = job.error_type = None
+                    self.finish(job, "cancelled")
+                else:
+                    self.finish(job, "failed" if job.error is not None else "done")
+
+    def run_thread(self, job):
+        kwargs = dict(job.kwargs)
+        if accepts_progress(job.function):
+            kwargs["progress"] = job.set_progress
+        job.result = job.function(**kwargs)
+
+    def run_process(self, job):
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=run_isolated,
+            args=(sender, job.function, job.kwargs, accepts_progress(job.function)),
+            daemon=True,
+        )
+        process.start()
+        sender.close()
+        try:
+            while True:
+                kind, value = receiver.recv()
+                if kind == "ready":
+                    # Only signalled once the child leads its process group
+                    with self.condition:
+                        job.process = process
+                        if job.cancel_requested:
+                            self.kill(job)
+                elif kind == "progress":
+                    job.set_progress(value)
+                else:
+                    break
+        except EOFError:
+            kind, value = "error", ("ProcessExit", "Job process exited early")
+        finally:
+            receiver.close()
+            process.join()
+        if kind == "done":
+            job.result = value
+        else:
+            job.error_type, job.error = value
+
+    def kill(self, job):
+        process = job.process
+        if process is None or not process.is_alive():
+            return
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                process.terminate()
+        else:
+            process.terminate()
+
+    def finish(self, job, status):
+        # Called with the condition held
+        job.status = status
+        job.finished = ttime()
+        job.process = None
+        job.kwargs = None
+        self.counters[job.queue_name][status] += 1
+        self.wait_times[job.queue_name].append(job.wait_time)
+        metrics.observe("job_wait", job.wait_time, queue=job.queue_name)
+        if job.started is not None:
+            self.run_times[job.queue_name].append(job.run_time)
+            metrics.observe("job_run", job.run_time, queue=job.queue_name)
+        metrics.increment("jobs", queue=job.queue_name, status=status)
+        job.done.set()
+
+        finished = [job_id for job_id, job in self.jobs.items() if job.done.is_set()]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        def summary(samples):
+            if not samples:
+                return {"mean": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+            samples = np.asarray(samples)
+            return {
+                "mean": float(samples.mean()),
+                "p50": float(np.percentile(samples, 50)),
+                "p99": float(np.percentile(samples, 99)),
+                "max": float(samples.max()),
+            }
+
+        with self.condition:
+            return {
+                queue_name: {
+                    "queued": len(queue),
+                    "running": self.running[queue_name],
+                    **self.counters[queue_name],
+                    "wait_time": summary(self.wait_times[queue_name]),
+                    "run_time": summary(self.run_times[queue_name]),
+                }
+                for queue_name, queue in self.queues.items()
+            }
@@ -0,0 +1,167 @@
+import threading
+from contextlib import contextmanager
+from time import time as ttime
+
+# Upper bounds in seconds of the histogram buckets, the last one is +Inf
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Metrics:
+    """
+    Process-wide stage timings, counters and gauges. Timings are histograms
+    keyed by stage and labels (e.g. the F0 method or job queue); counters
+    are running totals (e.g. cache hits) and gauges current values (e.g.
+    queue depth). summary() gives a JSON-friendly dict and prometheus() the
+    text exposition format.
+    """
+
+    def __init__(self, prefix="rvc"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+        self.gauges = {}
+
+    @staticmethod
+    def labels_key(labels):
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, stage, seconds, **labels):
+        key = (stage, self.labels_key(labels))
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "max": 0.0,
+                    "buckets": [0] * (len(buckets) + 1),
+                }
+            timing["count"] += 1
+            timing["sum"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+            for i, bound in enumerate(buckets):
+                if seconds <= bound:
+                    timing["buckets"][i] += 1
+                    break
+            else:
+                timing["buckets"][-1] += 1
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        t0 = ttime()
+        try:
+            yield
+        finally:
+            self.observe(stage, ttime() - t0, **labels)
+
+    def increment(self, counter, value=1, **labels):
+        key = (counter, self.labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, gauge, value, **labels):
+        with self.lock:
+            self.gauges[(gauge, self.labels_key(labels))] = value
+
+    def take(self):
+        # Hands the collected data over, e.g. from a worker process to merge()
+        with self.lock:
+            data = (self.timings, self.counters)
+            self.timings, self.counters = {}, {}
+        return data
+
+    def merge(self, data):
+        timings, counters = data
+        with self.lock:
+            for key, timing in timings.items():
+                total = self.timings.get(key)
+                if total is None:
+                    self.timings[key] = timing
+                    continue
+                total["count"] += timing["count"]
+                total["sum"] += timing["sum"]
+                total["max"] = max(total["max"], timing["max"])
+                total["buckets"] = [
+                    a + b for a, b in zip(total["buckets"], timing["buckets"])
+                ]
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.timings.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    @staticmethod
+    def label_name(name, labels):
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{key}={value}" for key, value in labels) + "}"
+
+    def summary(self):
+        with self.lock:
+            stages = {
+                self.label_name(stage, labels): {
+                    "count": timing["count"],
+                    "total": timing["sum"],
+                    "mean": timing["sum"] / timing["count"],
+                    "max": timing["max"],
+                }
+                for (stage, labels), timing in sorted(self.timings.items())
+            }
+            counters = {
+                self.label_name(counter, labels): value
+                for (counter, labels), value in sorted(self.counters.items())
+            }
+            gauges = {
+                self.label_name(gauge, labels): value
+                for (gauge, labels), value in sorted(self.gauges.items())
+            }
+        return {"stages": stages, "counters": counters, "gauges": gauges}
+
+    def prometheus(self):
+        def format_labels(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+        lines = []
+        with self.lock:
+            timings = sorted(self.timings.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+            seen = set()
+            for (stage, labels), timing in timings:
+                name = f"{self.prefix}_{stage}_seconds"
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(buckets + ("+Inf",), timing["buckets"]):
+                    cumulative += count
+                    bucket_labels = format_labels(labels, [("le", bound)])
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {timing['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {timing['count']}")
+
+            for (counter, labels), value in counters:
+                name = f"{self.prefix}_{counter}_total"
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+            for (gauge, labels), value in gauges:
+                name = f"{self.prefix}_{gauge}"
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
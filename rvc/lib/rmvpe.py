@@ -321,7 +321,7 @@ class MelSpectrogram(torch.nn.Module):
 
 
 class RMVPE:
-    def __init__(self, model_path, is_half, device=None):
+    def __init__(self, model_path, is_half, device=None, chunk_size=None, overlap=256):
         self.resample_kernel = {}
         model = E2E(4, 1, (2, 2))
         ckpt = torch.load(model_path, map_location="cpu")
@@ -341,6 +341,11 @@ class RMVPE:
         self.model = self.model.to(device)
         cents_mapping = 20 * np.arange(360) + 1997.3794084376191
         self.cents_mapping = np.pad(cents_mapping, (4, 4))  # 368
+        # Long inputs are run in windows of chunk_size mel frames plus
+        # overlap frames of context on each side, both kept on the 32 frame
+        # grid of the U-Net so pooling sees the same frames as in one pass
+        self.chunk_size = None if chunk_size is None else -(-chunk_size // 32) * 32
+        self.overlap = -(-overlap // 32) * 32
 
     def mel2hidden(self, mel):
         with torch.no_grad():
@@ -357,11 +362,43 @@ class RMVPE:
         f0[f0 == 10] = 0
         return f0
 
+    def audio2hidden_chunked(self, audio):
+        hop_length = self.mel_extractor.hop_length
+        n_fft = self.mel_extractor.n_fft
+        n_frames = audio.shape[0] // hop_length + 1
+        audio = torch.from_numpy(audio).float().to(self.device)
+        # Same reflect padding torch.stft applies with center=True, so every
+        # chunk's frames are the frames of the whole-file spectrogram
+        audio = F.pad(audio.view(1, 1, -1), (n_fft // 2, n_fft // 2), mode="reflect")
+        audio = audio.view(1, -1)
+        hiddens = []
+        for start in range(0, n_frames, self.chunk_size):
+            end = min(start + self.chunk_size, n_frames)
+            context_start = max(start - self.overlap, 0)
+            context_end = min(end + self.overlap, n_frames)
+            mel = self.mel_extractor(
+                audio[
+                    :,
+                    context_start * hop_length : (context_end - 1) * hop_length + n_fft,
+                ],
+                center=False,
+            )
+            hidden = self.mel2hidden(mel)
+            hiddens.append(
+                hidden[0, start - context_start : end - context_start].cpu().numpy()
+            )
+            del mel, hidden
+        return np.concatenate(hiddens)
+
     def infer_from_audio(self, audio, thred=0.03):
-        audio = torch.from_numpy(audio).float().to(self.device).unsqueeze(0)
-        mel = self.mel_extractor(audio, center=True)
-        hidden = self.mel2hidden(mel)
-        hidden = hidden.squeeze(0).cpu().numpy()
+        n_frames = audio.shape[0] // self.mel_extractor.hop_length + 1
+        if self.chunk_size is not None and n_frames > self.chunk_size + self.overlap:
+            hidden = self.audio2hidden_chunked(audio)
+        else:
+            audio = torch.from_numpy(audio).float().to(self.device).unsqueeze(0)
+            mel = self.mel_extractor(audio, center=True)
+            hidden = self.mel2hidden(mel)
+            hidden = hidden.squeeze(0).cpu().numpy()
         if self.is_half == True:
             hidden = hidden.astype("float32")
         f0 = self.decode(hidden, thred=thred)
@@ -370,16 +407,10 @@ class RMVPE:
     def to_local_average_cents(self, salience, thred=0.05):
         center = np.argmax(salience, axis=1)
         salience = np.pad(salience, ((0, 0), (4, 4)))
-        center += 4
-        todo_salience = []
-        todo_cents_mapping = []
-        starts = center - 4
-        ends = center + 5
-        for idx in range(salience.shape[0]):
-            todo_salience.append(salience[:, starts[idx] : ends[idx]][idx])
-            todo_cents_mapping.append(self.cents_mapping[starts[idx] : ends[idx]])
-        todo_salience = np.array(todo_salience)
-        todo_cents_mapping = np.array(todo_cents_mapping)
+        # 9-bin window around the argmax of every frame, in padded coordinates
+        window = center[:, None] + np.arange(9)
+        todo_salience = np.take_along_axis(salience, window, axis=1)
+        todo_cents_mapping = self.cents_mapping[window]
         product_sum = np.sum(todo_salience * todo_cents_mapping, 1)
         weight_sum = np.sum(todo_salience, 1)
         devided = product_sum / weight_sum
@@ -1,105 +1,85 @@
-from pydub.silence import detect_nonsilent
-from pydub import AudioSegment
 import numpy as np
-import re
-import os
 
-from rvc.lib.utils import format_title
 
-
-def process_audio(file_path):
-    try:
-        # load audio file
-        song = AudioSegment.from_file(file_path)
-
-        # set silence threshold and duration
-        silence_thresh = -70  # dB
-        min_silence_len = 750  # ms, adjust as needed
-
-        # detect nonsilent parts
-        nonsilent_parts = detect_nonsilent(song, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
-
-        # Create a new directory to store chunks
-        file_dir = os.path.dirname(file_path)
-        file_name = os.path.basename(file_path).split('.')[0]
-        file_name = format_title(file_name)
-        new_dir_path = os.path.join(file_dir, file_name)
-        os.makedirs(new_dir_path, exist_ok=True)
-
-        # Check if timestamps file exists, if so delete it
-        timestamps_file = os.path.join(file_dir, f"{file_name}_timestamps.txt")
-        if os.path.isfile(timestamps_file):
-            os.remove(timestamps_file)
-
-        # export chunks and save start times
-        segment_count = 0
-        for i, (start_i, end_i) in enumerate(nonsilent_parts):
-            chunk = song[start_i:end_i]
-            chunk_file_path = os.path.join(new_dir_path, f"chunk{i}.wav")
-            chunk.export(chunk_file_path, format="wav")
-
-            print(f"Segment {i} created!")
-            segment_count += 1
-
-            # write start times to file
-            with open(timestamps_file, "a", encoding="utf-8") as f:
-                f.write(f"{chunk_file_path} starts at {start_i} ms\n")
-
-        print(f"Total segments created: {segment_count}")
-        print(f"Split all chunks for {file_path} successfully!")
-
-        return "Finish", new_dir_path
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return "Error", None
-
-
-def merge_audio(timestamps_file):
-    try:
-        # Extract prefix from the timestamps filename
-        prefix = os.path.basename(timestamps_file).replace('_timestamps.txt', '')
-        timestamps_dir = os.path.dirname(timestamps_file)
-
-        # Open the timestamps file
-        with open(timestamps_file, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-
-        # Initialize empty list to hold audio segments
-        audio_segments = []
-        last_end_time = 0
-
-        print(f"Processing file: {timestamps_file}")
-
-        for line in lines:
-            # Extract filename and start time from line
-            match = re.search(r"(chunk\d+.wav) starts at (\d+) ms", line)
-            if match:
-                filename, start_time = match.groups()
-                start_time = int(start_time)
-
-                # Construct the complete path to the chunk file
-                chunk_file = os.path.join(timestamps_dir, prefix, filename)
-
-                # Add silence from last_end_time to start_time
-                silence_duration = max(start_time - last_end_time, 0)
-                silence = AudioSegment.silent(duration=silence_duration)
-                audio_segments.append(silence)
-
-                # Load audio file and append to list
-                audio = AudioSegment.from_wav(chunk_file)
-                audio_segments.append(audio)
-
-                # Update last_end_time
-                last_end_time = start_time + len(audio)
-
-                print(f"Processed chunk: {chunk_file}")
-
-        # Concatenate all audio_segments and export
-        merged_audio = sum(audio_segments)
-        merged_audio_np = np.array(merged_audio.get_array_of_samples())
-        #print(f"Exported merged file: {merged_filename}\n")
-        return merged_audio.frame_rate, merged_audio_np
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
\ No newline at end of file
+def detect_nonsilent(pcm, sr, silence_thresh=-70, min_silence_len=750):
+    """
+    Non-silent (start, end) ranges in ms of int16 mono audio, the same as
+    pydub.silence.detect_nonsilent with seek_step=1. The RMS of every
+    min_silence_len window at a 1 ms hop comes from running sums of the
+    per-millisecond energy instead of one slice per window.
+    """
+    seg_len = round(1000 * pcm.shape[0] / sr)
+    if seg_len < min_silence_len:
+        return [(0, seg_len)]
+
+    # Sample offset of every millisecond, rounded like pydub slices
+    bounds = (np.arange(seg_len + 1) * (sr / 1000.0)).astype(np.int64)
+    if bounds[-1] > pcm.shape[0]:
+        pcm = np.pad(pcm, (0, bounds[-1] - pcm.shape[0]))
+    energy = np.zeros(seg_len + 1, dtype=np.int64)
+    step = 60000
+    for i in range(0, seg_len, step):
+        b = bounds[i : i + step + 1]
+        squares = np.square(pcm[b[0] : b[-1]].astype(np.int64))
+        sums = np.add.reduceat(squares, b[:-1] - b[0])
+        # reduceat gives the next sample instead of 0 for empty milliseconds
+        sums[b[1:] == b[:-1]] = 0
+        energy[i + 1 : i + b.shape[0]] = sums
+    energy = np.cumsum(energy)
+
+    starts = np.arange(seg_len - min_silence_len + 1)
+    ends = starts + min_silence_len
+    counts = bounds[ends] - bounds[starts]
+    power = (energy[ends] - energy[starts]) / np.maximum(counts, 1)
+    # audioop.rms truncates to an integer
+    rms = np.floor(np.sqrt(power))
+    threshold = 10 ** (silence_thresh / 20) * 32768
+    silence_starts = np.flatnonzero(rms <= threshold)
+    if silence_starts.shape[0] == 0:
+        return [(0, seg_len)]
+
+    # Overlapping or touching silent windows make one silent range
+    breaks = np.flatnonzero(np.diff(silence_starts) > min_silence_len)
+    range_starts = silence_starts[np.concatenate(([0], breaks + 1))]
+    range_ends = silence_starts[np.concatenate((breaks, [-1]))] + min_silence_len
+    if range_starts[0] == 0 and range_ends[0] == seg_len:
+        return []
+
+    nonsilent = list(zip([0] + range_ends.tolist(), range_starts.tolist() + [seg_len]))
+    if range_ends[-1] == seg_len:
+        nonsilent.pop()
+    if nonsilent[0] == (0, 0):
+        nonsilent.pop(0)
+    return nonsilent
+
+
+def process_audio(audio, sr, silence_thresh=-70, min_silence_len=750):
+    """
+    Non-silent regions of a mono float array as (start, end) sample offsets.
+    silence_thresh is in dBFS and min_silence_len in ms.
+    """
+    pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+    nonsilent_parts = detect_nonsilent(
+        pcm, sr, silence_thresh=silence_thresh, min_silence_len=min_silence_len
+    )
+    regions = [
+        (start_i * sr // 1000, min(end_i * sr // 1000, audio.shape[0]))
+        for start_i, end_i in nonsilent_parts
+    ]
+    print(f"Total segments created: {len(regions)}")
+    return regions
+
+
+def merge_audio(chunks, regions, length, sr, tgt_sr):
+    """
+    Write the converted chunks at the offsets of their regions into one
+    buffer of the length of the input, the gaps between them stay silent.
+    length and regions are in samples at sr, chunks at tgt_sr.
+    """
+    dtype = chunks[0].dtype if chunks else np.int16
+    merged = np.zeros(length * tgt_sr // sr, dtype=dtype)
+    for chunk, (start, _) in zip(chunks, regions):
+        offset = start * tgt_sr // sr
+        size = max(0, min(chunk.shape[0], merged.shape[0] - offset))
+        merged[offset : offset + size] = chunk[:size]
+    return merged
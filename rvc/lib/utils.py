@@ -1,26 +1,81 @@
+import io
+import os
 import ffmpeg
 import numpy as np
 import re
 import unicodedata
+import soundfile as sf
+from functools import lru_cache
+from math import gcd
+from scipy import signal
+
+from rvc.lib.metrics import metrics
+
+
+@lru_cache(maxsize=16)
+def resample_filter(up, down):
+    # Same anti-aliasing filter resample_poly designs by default, built once
+    # per rate pair instead of on every call
+    max_rate = max(up, down)
+    return signal.firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0))
+
+
+def resample_audio(audio, orig_sr, target_sr):
+    if orig_sr == target_sr:
+        return audio
+    divisor = gcd(orig_sr, target_sr)
+    up, down = target_sr // divisor, orig_sr // divisor
+    return signal.resample_poly(
+        audio, up, down, window=resample_filter(up, down)
+    ).astype(np.float32)
+
+
+def load_audio_ffmpeg(file, sampling_rate):
+    if isinstance(file, bytes):
+        stream, data = ffmpeg.input("pipe:0", threads=0), file
+    else:
+        stream, data = ffmpeg.input(file, threads=0), None
+    out, _ = stream.output(
+        "-", format="f32le", acodec="pcm_f32le", ac=1, ar=sampling_rate
+    ).run(
+        cmd=["ffmpeg", "-nostdin"],
+        input=data,
+        capture_stdout=True,
+        capture_stderr=True,
+    )
+    return np.frombuffer(out, np.float32).copy()
 
 
 def load_audio(file, sampling_rate):
+    """
+    Decode a path, bytes or a binary file-like object to mono float32 at
+    sampling_rate. Formats libsndfile reads (WAV, FLAC, OGG) are decoded in
+    process; anything else goes through ffmpeg.
+    """
     try:
-        file = file.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
-        out, _ = (
-            ffmpeg.input(file, threads=0)
-            .output("-", format="f32le", acodec="pcm_f32le", ac=1, ar=sampling_rate)
-            .run(cmd=["ffmpeg", "-nostdin"], capture_stdout=True, capture_stderr=True)
-        )
+        if isinstance(file, os.PathLike):
+            file = os.fspath(file)
+        if isinstance(file, str):
+            file = file.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
+        elif not isinstance(file, bytes):
+            file = file.read()
+        with metrics.timer("decode"):
+            try:
+                source = io.BytesIO(file) if isinstance(file, bytes) else file
+                audio, sr = sf.read(source, dtype="float32", always_2d=True)
+            except Exception:
+                return load_audio_ffmpeg(file, sampling_rate)
+            audio = audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+            return np.ascontiguousarray(resample_audio(audio, sr, sampling_rate))
     except Exception as error:
         raise RuntimeError(f"Failed to load audio: {error}")
 
-    return np.frombuffer(out, np.float32).flatten()
-
 
 def format_title(title):
-    formatted_title = unicodedata.normalize('NFKD', title).encode('ascii', 'ignore').decode('utf-8')
-    formatted_title = re.sub(r'[\u2500-\u257F]+', '', formatted_title)
-    formatted_title = re.sub(r'[^\w\s.-]', '', formatted_title)
-    formatted_title = re.sub(r'\s+', '_', formatted_title)
-    return formatted_title
\ No newline at end of file
+    formatted_title = (
+        unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode("utf-8")
+    )
+    formatted_title = re.sub(r"[\u2500-\u257F]+", "", formatted_title)
+    formatted_title = re.sub(r"[^\w\s.-]", "", formatted_title)
+    formatted_title = re.sub(r"\s+", "_", formatted_title)
+    return formatted_title
@@ -1,4 +1,7 @@
 from multiprocessing import cpu_count
+from time import time as ttime
+import hashlib
+import json
 import os
 import sys
 
@@ -6,6 +9,7 @@ from scipy import signal
 from scipy.io import wavfile
 import librosa
 import numpy as np
+import soundfile as sf
 
 now_directory = os.getcwd()
 sys.path.append(now_directory)
@@ -42,6 +46,15 @@ class PreProcess:
         self.exp_dir = exp_dir
         self.gt_wavs_dir = f"{exp_dir}/0_gt_wavs"
         self.wavs16k_dir = f"{exp_dir}/1_16k_wavs"
+        self.manifest_path = f"{exp_dir}/preprocess_manifest.json"
+        # Outputs of the later steps, named after the slices
+        self.derived_files = [
+            (self.gt_wavs_dir, ".spec.pt"),
+            (f"{exp_dir}/2a_f0", ".wav.npy"),
+            (f"{exp_dir}/2b-f0nsf", ".wav.npy"),
+            (f"{exp_dir}/3_feature256", ".npy"),
+            (f"{exp_dir}/3_feature768", ".npy"),
+        ]
         os.makedirs(self.exp_dir, exist_ok=True)
         os.makedirs(self.gt_wavs_dir, exist_ok=True)
         os.makedirs(self.wavs16k_dir, exist_ok=True)
@@ -50,7 +63,7 @@ class PreProcess:
         tmp_max = np.abs(tmp_audio).max()
         if tmp_max > 2.5:
             print(f"{idx0}-{idx1}-{tmp_max}-filtered")
-            return
+            return None
         tmp_audio = (tmp_audio / tmp_max * (self.max_amplitude * self.alpha)) + (
             1 - self.alpha
         ) * tmp_audio
@@ -67,13 +80,17 @@ class PreProcess:
             16000,
             tmp_audio.astype(np.float32),
         )
+        return f"{idx0}_{idx1}"
 
     def process_audio(self, path, idx0):
+        # Returns the names of the written slices and the length of the audio
+        # in seconds, None if it failed
         try:
             audio = load_audio(path, self.sr)
             audio = signal.lfilter(self.b_high, self.a_high, audio)
 
             idx1 = 0
+            slices = []
             for audio_segment in self.slicer.slice(audio):
                 i = 0
                 while 1:
@@ -83,40 +100,171 @@ class PreProcess:
                         tmp_audio = audio_segment[
                             start : start + int(self.per * self.sr)
                         ]
-                        self.normalize_and_write(tmp_audio, idx0, idx1)
+                        slices.append(self.normalize_and_write(tmp_audio, idx0, idx1))
                         idx1 += 1
                     else:
                         tmp_audio = audio_segment[start:]
                         idx1 += 1
                         break
-                self.normalize_and_write(tmp_audio, idx0, idx1)
+                slices.append(self.normalize_and_write(tmp_audio, idx0, idx1))
+            return [name for name in slices if name], audio.shape[0] / self.sr
         except Exception as error:
             print(f"{path}: {error}")
 
-    def process_audio_multiprocessing(self, infos):
-        for path, idx0 in infos:
-            self.process_audio(path, idx0)
+    def process_audio_timed(self, info):
+        path, idx0 = info
+        t0 = ttime()
+        result = self.process_audio(path, idx0)
+        return path, idx0, result, ttime() - t0
+
+    def remove_slices(self, names, derived_only=False):
+        directories = list(self.derived_files)
+        if not derived_only:
+            directories += [(self.gt_wavs_dir, ".wav"), (self.wavs16k_dir, ".wav")]
+        for directory, extension in directories:
+            for name in names:
+                path = f"{directory}/{name}{extension}"
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def orphan_slices(self, live):
+        orphans = set()
+        directories = [self.gt_wavs_dir, self.wavs16k_dir]
+        directories += [directory for directory, _ in self.derived_files]
+        for directory in directories:
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if name.split(".")[0] not in live:
+                        orphans.add(name.split(".")[0])
+        return orphans
 
     def process_audio_multiprocessing_input_directory(self, input_root, num_processes):
         try:
+            settings = {"sr": self.sr, "per": self.per}
+            manifest = load_manifest(self.manifest_path)
+            if manifest.get("settings") != settings:
+                # Every slice changes with the sampling rate or slice length
+                manifest = {"settings": settings, "sources": {}}
+            known = manifest["sources"]
+
+            sources, todo = {}, {}
+            for name in sorted(list(os.listdir(input_root))):
+                path = f"{input_root}/{name}"
+                if not os.path.isfile(path):
+                    continue
+                entry = known.get(name)
+                try:
+                    stat = os.stat(path)
+                    if entry is None or (entry["size"], entry["mtime"]) != (
+                        stat.st_size,
+                        stat.st_mtime,
+                    ):
+                        source = {"id": source_id(path), "slices": None}
+                        if entry is not None and entry["id"] == source["id"]:
+                            source["slices"] = entry["slices"]
+                    else:
+                        source = dict(entry)
+                except OSError as error:
+                    print(f"{path}: {error}")
+                    continue
+                source.update({"size": stat.st_size, "mtime": stat.st_mtime})
+                sources[name] = source
+                if source["slices"] is None:
+                    todo.setdefault(source["id"], path)
+
+            # Copies of a file that is already sliced need no work either
+            done_ids = {
+                source["id"]: source["slices"]
+                for source in sources.values()
+                if source["slices"] is not None
+            }
             infos = [
-                (f"{input_root}/{name}", idx)
-                for idx, name in enumerate(sorted(list(os.listdir(input_root))))
+                (path, idx0) for idx0, path in todo.items() if idx0 not in done_ids
             ]
-            processes = []
-            for i in range(num_processes):
-                p = multiprocessing.Process(
-                    target=self.process_audio_multiprocessing,
-                    args=(infos[i::num_processes],),
-                )
-                processes.append(p)
-                p.start()
-            for i in range(num_processes):
-                processes[i].join()
+            print(
+                f"{len(sources)} files, {len(infos)} new or changed, "
+                f"{len(set(known) - set(sources))} removed"
+            )
+
+            # Longest first, the workers take the next file when they are done
+            # so the short ones fill in around the long ones at the end
+            infos.sort(key=lambda info: audio_length(info[0]), reverse=True)
+            t0 = ttime()
+            total_audio = total_time = 0.0
+            try:
+                with multiprocessing.Pool(num_processes) as pool:
+                    for done, (path, idx0, result, elapsed) in enumerate(
+                        pool.imap_unordered(self.process_audio_timed, infos), 1
+                    ):
+                        total_time += elapsed
+                        if result is None:
+                            continue
+                        slices, duration = result
+                        # Features of an earlier run under the same names are stale
+                        self.remove_slices(slices, derived_only=True)
+                        done_ids[idx0] = slices
+                        total_audio += duration
+                        print(
+                            f"[{done}/{len(infos)}] {os.path.basename(path)}: "
+                            f"{duration:.1f}s of audio in {elapsed:.2f}s"
+                        )
+            finally:
+                # Failed sources are tried again next time
+                manifest["sources"] = {
+                    name: dict(source, slices=done_ids[source["id"]])
+                    for name, source in sources.items()
+                    if source["id"] in done_ids
+                }
+                save_manifest(self.manifest_path, manifest)
+
+            live = {
+                name
+                for source in manifest["sources"].values()
+                for name in source["slices"]
+            }
+            orphans = self.orphan_slices(live)
+            self.remove_slices(orphans)
+            wall_time = ttime() - t0
+            print(
+                f"Processed {len(infos)} files, {total_audio:.1f}s of audio, in "
+                f"{wall_time:.1f}s ({total_time:.1f}s of work on "
+                f"{num_processes} processes), removed {len(orphans)} old slices"
+            )
         except Exception as error:
             print(error)
 
 
+def source_id(path):
+    # Stable across runs and renames, it only changes with the content
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()[:16]
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def audio_length(path):
+    # Seconds for files soundfile can read, else estimated from the size
+    try:
+        return sf.info(path).duration
+    except Exception:
+        return os.path.getsize(path) / 16000
+
+
 def preprocess_training_set(input_root, sr, num_processes, exp_dir, per):
     pp = PreProcess(sr, exp_dir, per)
     print("Starting preprocessing...")
@@ -7,6 +7,11 @@ from multiprocessing import cpu_count
 
 exp_dir = sys.argv[1]
 version = sys.argv[2]
+# dtype of the feature sidecar read by inference, float16 halves its size
+try:
+    features_dtype = sys.argv[3]
+except IndexError:
+    features_dtype = "float32"
 
 try:
     if version == "v1":
@@ -79,6 +84,12 @@ try:
 
     faiss.write_index(index_added, index_filepath_added)
 
+    # Vectors were added without explicit ids, so row i of the sidecar is
+    # the vector with id i and inference can gather search results from a
+    # memory map instead of reconstructing the whole index
+    features_filepath_added = os.path.splitext(index_filepath_added)[0] + ".npy"
+    np.save(features_filepath_added, big_npy.astype(features_dtype))
+
 except Exception as error:
     print(f"Failed to train index: {error}")
 
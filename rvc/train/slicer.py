@@ -33,6 +33,90 @@ class Slicer:
             end_idx = min(waveform.shape[0], end * self.hop_size)
             return waveform[start_idx:end_idx]
 
+    def _argmin(self, rms_padded, starts, ends):
+        # First minimum of rms_list[start:end] for every pair, all of them at
+        # most max_sil_kept + 1 frames long
+        windows = np.lib.stride_tricks.sliding_window_view(
+            rms_padded, self.max_sil_kept + 1
+        )[starts]
+        outside = np.arange(self.max_sil_kept + 1) >= (ends - starts)[:, None]
+        return starts + np.where(outside, np.inf, windows).argmin(axis=1)
+
+    def _sil_tags(self, rms_list):
+        """
+        Silences to cut as (begin, end) frames. Runs of silent frames are
+        found with run-length encoding and the candidate cut positions of
+        all of them are computed at once, only the choice of which runs to
+        cut depends on the previous cut and walks the runs.
+        """
+        total_frames = rms_list.shape[0]
+        max_sil_kept = self.max_sil_kept
+        silent = np.concatenate(([False], rms_list < self.threshold, [False]))
+        edges = np.flatnonzero(silent[1:] != silent[:-1])
+        run_starts, run_ends = edges[0::2], edges[1::2]
+
+        sil_tags = []
+        trailing = None
+        if run_starts.shape[0] and run_ends[-1] == total_frames:
+            trailing = run_starts[-1]
+            run_starts, run_ends = run_starts[:-1], run_ends[:-1]
+
+        # Runs that are too short and not leading silence are never cut
+        lengths = run_ends - run_starts
+        candidates = (lengths >= self.min_interval) | (
+            (run_starts == 0) & (run_ends > max_sil_kept)
+        )
+        starts, ends = run_starts[candidates], run_ends[candidates]
+        if starts.shape[0]:
+            rms_padded = np.concatenate(
+                (rms_list, np.full(max_sil_kept + 1, np.inf, dtype=rms_list.dtype))
+            )
+            kept_starts = np.maximum(ends - max_sil_kept, 0)
+            # Whole run, the overlap of both ends, and each end on its own
+            pos_run = self._argmin(rms_padded, starts, ends + 1)
+            pos_mid = self._argmin(
+                rms_padded,
+                kept_starts,
+                np.maximum(starts + max_sil_kept + 1, kept_starts),
+            )
+            pos_left = self._argmin(rms_padded, starts, starts + max_sil_kept + 1)
+            pos_right = self._argmin(rms_padded, kept_starts, ends + 1)
+
+            clip_start = 0
+            for start, i, pos, pos_m, pos_l, pos_r in zip(
+                starts.tolist(),
+                ends.tolist(),
+                pos_run.tolist(),
+                pos_mid.tolist(),
+                pos_left.tolist(),
+                pos_right.tolist(),
+            ):
+                is_leading_silence = start == 0 and i > max_sil_kept
+                need_slice_middle = (
+                    i - start >= self.min_interval and i - clip_start >= self.min_length
+                )
+                if not is_leading_silence and not need_slice_middle:
+                    continue
+                if i - start <= max_sil_kept:
+                    sil_tags.append((0, pos) if start == 0 else (pos, pos))
+                    clip_start = pos
+                elif i - start <= max_sil_kept * 2:
+                    if start == 0:
+                        sil_tags.append((0, pos_r))
+                        clip_start = pos_r
+                    else:
+                        sil_tags.append((min(pos_l, pos_m), max(pos_r, pos_m)))
+                        clip_start = max(pos_r, pos_m)
+                else:
+                    sil_tags.append((0, pos_r) if start == 0 else (pos_l, pos_r))
+                    clip_start = pos_r
+
+        if trailing is not None and total_frames - trailing >= self.min_interval:
+            silence_end = min(total_frames, trailing + max_sil_kept)
+            pos = rms_list[trailing : silence_end + 1].argmin() + trailing
+            sil_tags.append((int(pos), total_frames + 1))
+        return sil_tags
+
     def slice(self, waveform):
         samples = waveform.mean(axis=0) if len(waveform.shape) > 1 else waveform
         if samples.shape[0] <= self.min_length:
@@ -41,86 +125,9 @@ class Slicer:
         rms_list = get_rms(
             y=samples, frame_length=self.win_size, hop_length=self.hop_size
         ).squeeze(0)
-        sil_tags = []
-        silence_start, clip_start = None, 0
-
-        for i, rms in enumerate(rms_list):
-            if rms < self.threshold:
-                if silence_start is None:
-                    silence_start = i
-                continue
-
-            if silence_start is None:
-                continue
-
-            is_leading_silence = silence_start == 0 and i > self.max_sil_kept
-            need_slice_middle = (
-                i - silence_start >= self.min_interval
-                and i - clip_start >= self.min_length
-            )
-
-            if not is_leading_silence and not need_slice_middle:
-                silence_start = None
-                continue
-
-            if i - silence_start <= self.max_sil_kept:
-                pos = rms_list[silence_start : i + 1].argmin() + silence_start
-                if silence_start == 0:
-                    sil_tags.append((0, pos))
-                else:
-                    sil_tags.append((pos, pos))
-                clip_start = pos
-            elif i - silence_start <= self.max_sil_kept * 2:
-                pos = rms_list[
-                    i - self.max_sil_kept : silence_start + self.max_sil_kept + 1
-                ].argmin()
-                pos += i - self.max_sil_kept
-                pos_l = (
-                    rms_list[
-                        silence_start : silence_start + self.max_sil_kept + 1
-                    ].argmin()
-                    + silence_start
-                )
-                pos_r = (
-                    rms_list[i - self.max_sil_kept : i + 1].argmin()
-                    + i
-                    - self.max_sil_kept
-                )
-                if silence_start == 0:
-                    sil_tags.append((0, pos_r))
-                    clip_start = pos_r
-                else:
-                    sil_tags.append((min(pos_l, pos), max(pos_r, pos)))
-                    clip_start = max(pos_r, pos)
-            else:
-                pos_l = (
-                    rms_list[
-                        silence_start : silence_start + self.max_sil_kept + 1
-                    ].argmin()
-                    + silence_start
-                )
-                pos_r = (
-                    rms_list[i - self.max_sil_kept : i + 1].argmin()
-                    + i
-                    - self.max_sil_kept
-                )
-                if silence_start == 0:
-                    sil_tags.append((0, pos_r))
-                else:
-                    sil_tags.append((pos_l, pos_r))
-                clip_start = pos_r
-            silence_start = None
-
+        sil_tags = self._sil_tags(rms_list)
         total_frames = rms_list.shape[0]
 
-        if (
-            silence_start is not None
-            and total_frames - silence_start >= self.min_interval
-        ):
-            silence_end = min(total_frames, silence_start + self.max_sil_kept)
-            pos = rms_list[silence_start : silence_end + 1].argmin() + silence_start
-            sil_tags.append((pos, total_frames + 1))
-
         if not sil_tags:
             return [waveform]
         else: